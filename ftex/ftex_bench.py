@@ -0,0 +1,187 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from lib.ftex import (
+    compression_profiles,
+    count_shared_chunks,
+    dds_mipmap_size,
+    dds_to_ftex_buffer,
+    encode_dds_header,
+    fmt_blk_cfg,
+    ftex_to_dds_buffer,
+)
+
+layouts = ["2d", "cube", "volume"]
+
+
+def make_dds(ftex_fmt: int, size: int, layout: str, seed: int = 0) -> bytes:
+    # Synthetic texture with a full mipmap chain. Half of every frame is noise
+    # and the other half a flat fill, so that compression has some work to do
+    # without every chunk being incompressible.
+    rng = random.Random(seed)
+    depth = 8 if layout == "volume" else 1
+    mipmap_count = size.bit_length()
+    frames = []
+    for _ in range(6 if layout == "cube" else 1):
+        for mipmap_index in range(mipmap_count):
+            length = dds_mipmap_size(ftex_fmt, size, size, depth, mipmap_index)
+            noise = length // 2
+            frames.append(rng.randbytes(noise))
+            frames.append(bytes([rng.randrange(256)]) * (length - noise))
+
+    header = encode_dds_header(
+        ftex_fmt, size, size, depth, mipmap_count, layout == "cube"
+    )
+    return header + b"".join(frames)
+
+
+def _best_time(func, repeat: int) -> tuple[float, bytes]:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def _peak_memory(func) -> int:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(
+    ftex_fmt: int,
+    size: int,
+    layout: str,
+    repeat: int,
+    workers: int,
+    profile: str,
+    dedup: bool = False,
+) -> dict:
+    dds_buffer = make_dds(ftex_fmt, size, layout)
+
+    def encode():
+        return dds_to_ftex_buffer(
+            dds_buffer, workers=workers, profile=profile, dedup=dedup
+        )
+
+    encode_seconds, ftex_buffer = _best_time(encode, repeat)
+
+    def decode():
+        return ftex_to_dds_buffer(ftex_buffer, workers=workers)
+
+    decode_seconds, dds_output = _best_time(decode, repeat)
+    if dds_output != dds_buffer:
+        raise Exception(f"Round trip mismatch for format {ftex_fmt} {layout} {size}")
+
+    megabytes = len(dds_buffer) / (1 << 20)
+    chunk_total, shared_chunks = count_shared_chunks(ftex_buffer)
+    return {
+        "format": ftex_fmt,
+        "layout": layout,
+        "size": size,
+        "dds_bytes": len(dds_buffer),
+        "ftex_bytes": len(ftex_buffer),
+        "chunks": chunk_total,
+        "shared_chunks": shared_chunks,
+        "encode_seconds": encode_seconds,
+        "encode_mb_s": megabytes / encode_seconds,
+        "encode_peak_bytes": _peak_memory(encode),
+        "decode_seconds": decode_seconds,
+        "decode_mb_s": megabytes / decode_seconds,
+        "decode_peak_bytes": _peak_memory(decode),
+    }
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    # Lists every case whose throughput dropped by more than the tolerance
+    # relative to the baseline run.
+    baseline_cases = {
+        (case["format"], case["layout"], case["size"]): case for case in baseline
+    }
+    regressions = []
+    for case in results:
+        if not (
+            old := baseline_cases.get((case["format"], case["layout"], case["size"]))
+        ):
+            continue
+        for key in ("encode_mb_s", "decode_mb_s"):
+            ratio = case[key] / old[key]
+            if ratio < 1 - tolerance:
+                regressions.append(
+                    f"format {case['format']} {case['layout']} {case['size']}: "
+                    f"{key} {old[key]:.1f} > {case[key]:.1f} ({ratio:.0%})"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="FTEX Benchmark")
+    parser.add_argument(
+        "--formats", type=int, nargs="*", choices=fmt_blk_cfg, default=list(fmt_blk_cfg)
+    )
+    parser.add_argument("--layouts", nargs="*", choices=layouts, default=layouts)
+    parser.add_argument("--sizes", type=int, nargs="*", default=[256, 1024])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--compression", choices=compression_profiles, default="max")
+    parser.add_argument("--dedup", action="store_true")
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = []
+    for ftex_fmt in args.formats:
+        for layout in args.layouts:
+            for size in args.sizes:
+                case = run_case(
+                    ftex_fmt,
+                    size,
+                    layout,
+                    args.repeat,
+                    args.workers,
+                    args.compression,
+                    args.dedup,
+                )
+                results.append(case)
+                print(
+                    f"FORMAT {ftex_fmt:2} {layout:6} {size:5}  "
+                    f"encode {case['encode_mb_s']:8.1f} MB/s "
+                    f"{case['encode_peak_bytes'] / (1 << 20):7.1f} MiB  "
+                    f"decode {case['decode_mb_s']:8.1f} MB/s "
+                    f"{case['decode_peak_bytes'] / (1 << 20):7.1f} MiB  "
+                    f"shared {case['shared_chunks']}/{case['chunks']} chunks"
+                )
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "workers": args.workers,
+        "compression": args.compression,
+        "dedup": args.dedup,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(report, fd, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)
+        if regressions := compare(results, baseline["results"], args.tolerance):
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(regression)
+            sys.exit(1)
@@ -1,11 +1,248 @@
 import argparse
 import copy
+import hashlib
+import json
 import os
+import shutil
+import struct
 import sys
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import repeat
 from subprocess import PIPE, Popen, check_output
+from typing import Iterable, Iterator
 
-from ftex_info import fmt_choices, ftex_check, ftex_fmt_str, FtexHeader
-from lib.ftex import dds_to_ftex_buffer, ftex_to_dds_buffer
+from ftex_info import (
+    fmt_choices,
+    ftex_check,
+    ftex_fmt_str,
+    FtexHeader,
+    read_header,
+)
+from lib.cache import ConversionCache
+from lib.external import ExternalConverter
+from lib.ftex import (
+    check_version_patch,
+    compression_profiles,
+    dds_to_ftex_buffer,
+    FtexsFiles,
+    count_shared_chunks,
+    ftex_to_dds_buffer,
+    patch_ftex_version,
+    report_stage,
+    set_profile_hook,
+    transcode_ftex_buffer,
+)
+from lib.pipeline import run_largest_first, run_pipeline
+from lib.profiling import StageProfiler
+
+# FTEX pixel formats by texconv format name.
+pixel_formats = {
+    "ARGB": 0,
+    "DXT1": 2,
+    "DXT3": 3,
+    "DXT5": 4,
+    "BC4": 8,
+    "BC5": 9,
+    "BC6": 10,
+    "BC7": 11,
+}
+
+# Target formats the in-process encoder can produce, by texconv format name.
+numpy_engine_formats = {
+    "ARGB": 0,
+    "DXT1": 2,
+    "DXT3": 3,
+    "DXT5": 4,
+}
+
+
+def texconv_format(conv_fmt: str) -> str:
+    match conv_fmt:
+        case "BC1":
+            return "DXT1"
+        case "BC2":
+            return "DXT3"
+        case "BC3":
+            return "DXT5"
+    return conv_fmt
+
+
+def finish_buffer(
+    dds_converted_buffer: bytes,
+    conv_ver: float,
+    profile: str,
+    dedup: bool = False,
+) -> bytes:
+    buffer_conv = dds_to_ftex_buffer(dds_converted_buffer, profile=profile, dedup=dedup)
+
+    # Only the version field of the header is rewritten. The rest of the
+    # buffer holds chunks that may be stored raw, so it can contain the same
+    # bytes as a version number.
+    if conv_ver is not None:
+        (encoded_ver,) = struct.unpack_from("< f", buffer_conv, 4)
+        if conv_ver != round(encoded_ver, 2):
+            buffer_conv = bytearray(buffer_conv)
+            struct.pack_into("< f", buffer_conv, 4, conv_ver)
+
+    return buffer_conv
+
+
+def passthrough_buffer(
+    buffer: bytes, ftex: FtexHeader, conv_fmt: str, conv_ver: float, path: str
+) -> bytes | None:
+    # A texture already in the target format keeps its pixel data, so its
+    # compressed chunks are carried over instead of going through a lossy
+    # round trip in the converter.
+    if pixel_formats.get(texconv_format(conv_fmt)) != ftex.pixel_fmt:
+        return None
+
+    if conv_ver is None:
+        conv_ver = 2.04 if ftex.pixel_fmt > 4 else 2.03
+    with FtexsFiles(path) as ftexs:
+        return transcode_ftex_buffer(buffer, conv_ver, ftexs=ftexs)
+
+
+def ftexs_digests(path: str, buffer: bytes) -> list[str | None]:
+    # Frames kept in .ftexs companions are part of the input as much as the
+    # ftex itself, so their contents go into the cache key too.
+    ftexs = FtexsFiles(path)
+    digests = []
+    for ftexs_number in range(1, FtexHeader(buffer).ftexs_count + 1):
+        try:
+            with open(ftexs.path(ftexs_number), "rb") as ftexs_stream:
+                digests.append(hashlib.sha256(ftexs_stream.read()).hexdigest())
+        except FileNotFoundError:
+            digests.append(None)
+    return digests
+
+
+def conversion_cache_key(
+    buffer: bytes,
+    path: str,
+    conv_fmt: str,
+    conv_ver: float,
+    profile: str,
+    engine: str,
+    dedup: bool = False,
+) -> str:
+    return ConversionCache.key(
+        buffer,
+        conv_fmt,
+        conv_ver,
+        profile,
+        engine,
+        dedup,
+        "texconv" if sys.platform == "win32" else "convert",
+        *ftexs_digests(path, buffer),
+    )
+
+
+def read_file(path: str) -> bytes:
+    start = time.perf_counter()
+    with open(path, "rb") as input_buffer:
+        buffer = input_buffer.read()
+    report_stage("read", start, len(buffer), len(buffer))
+    return buffer
+
+
+def write_converted(path: str, buffer_conv: bytes, dont_preserve_original: bool):
+    start = time.perf_counter()
+    if not dont_preserve_original:
+        os.rename(path, path.replace(".ftex", "_old.ftex"))
+
+    with open(path, "wb") as output_buffer:
+        output_buffer.write(buffer_conv)
+    report_stage("write", start, len(buffer_conv), len(buffer_conv))
+
+
+def conversion_result(
+    filename: str, ftex: FtexHeader, buffer_conv: bytes, dedup: bool = False
+) -> str:
+    ftex_conv = FtexHeader(buffer_conv)
+
+    result = (
+        f"Converting: {filename}\n"
+        f"FTEX VERSION {round(ftex.version, 2)} "
+        f"FORMAT {ftex_fmt_str[ftex.pixel_fmt]} > "
+        f"FTEX VERSION {round(ftex_conv.version, 2)} "
+        f"FORMAT {ftex_fmt_str[ftex_conv.pixel_fmt]}"
+    )
+    if dedup:
+        chunk_total, shared_chunks = count_shared_chunks(buffer_conv)
+        result += f"\nDEDUPLICATED {shared_chunks} OF {chunk_total} CHUNKS"
+    return result
+
+
+def convert_buffer(
+    buffer: bytes,
+    conv_fmt: str,
+    conv_ver: float,
+    path: str,
+    filedir: str,
+    keep_dds_file: bool,
+    profile: str = "max",
+    engine: str = "external",
+    dedup: bool = False,
+) -> bytes:
+    with FtexsFiles(path) as ftexs:
+        dds_buffer = ftex_to_dds_buffer(buffer, ftexs=ftexs)
+    conv_fmt = texconv_format(conv_fmt)
+
+    start = time.perf_counter()
+    if engine == "numpy":
+        # Imported here so that numpy is only needed when it is asked for.
+        from lib.bcn import convert_dds
+
+        if (ftex_fmt := numpy_engine_formats.get(conv_fmt)) is None:
+            raise Exception(f"{conv_fmt} is not supported by the numpy engine")
+        dds_converted_buffer = convert_dds(dds_buffer, ftex_fmt)
+    elif sys.platform == "win32":
+        dds_path = path.replace(".ftex", "_tmp.dds")
+        with open(dds_path, "wb") as df:
+            df.write(dds_buffer)
+
+        cmd = [
+            os.path.join("bin", "texconv.exe"),
+            "-f",
+            conv_fmt,
+            "-y",
+            "-o",
+            filedir,
+            dds_path,
+        ]
+        check_output(cmd)
+
+        with open(dds_path, "rb") as dcf:
+            dds_converted_buffer = dcf.read()
+
+        if not keep_dds_file:
+            os.remove(dds_path)
+    else:
+        cmd = [
+            "convert",
+            "-format",
+            "dds",
+            "-define",
+            f"dds:compression={conv_fmt.lower()}",
+            "-",
+            "-",
+        ]
+        proc = Popen(
+            cmd,
+            stdin=PIPE,
+            stdout=PIPE,
+            stderr=PIPE,
+        )
+        dds_converted_buffer, p_err = proc.communicate(dds_buffer)
+
+        if p_err:
+            raise Exception(p_err.decode("utf-8"))
+    report_stage("convert", start, len(dds_buffer), len(dds_converted_buffer))
+
+    return finish_buffer(dds_converted_buffer, conv_ver, profile, dedup)
 
 
 def check_and_convert(
@@ -17,6 +254,10 @@ def check_and_convert(
     dont_preserve_original: bool,
     keep_dds_file: bool,
     filedir: str = None,
+    cache: ConversionCache = None,
+    profile: str = "max",
+    engine: str = "external",
+    dedup: bool = False,
 ) -> str | None:
     if filename.split(".")[-1].lower() != "ftex":
         return
@@ -27,106 +268,371 @@ def check_and_convert(
         path = filename
         filedir = os.path.dirname(filename)
 
-    with open(path, "rb") as input_buffer:
-        buffer = input_buffer.read()
-
     chk_fmt = [chk_fmt] if chk_fmt else []
+    if not conv_fmt:
+        return retag_version(
+            path, filename, chk_fmt, chk_ver, conv_ver, dont_preserve_original
+        )
+
+    buffer = read_file(path)
+
     if not (ftex := ftex_check(buffer, chk_fmt, chk_ver)):
         return
 
-    if not conv_fmt and conv_ver != round(ftex.version, 2):
-        ftex203 = b"\x85\xeb\x01@"
-        ftex204 = b"\\\x8f\x02@"
-        match conv_ver:
-            case 2.03:
-                buffer_conv = buffer.replace(ftex204, ftex203)
-            case 2.04:
-                buffer_conv = buffer.replace(ftex203, ftex204)
-            case _:
-                return
-
-        if not dont_preserve_original:
-            os.rename(path, path.replace(".ftex", "_old.ftex"))
-
-        with open(path, "wb") as output_buffer:
-            output_buffer.write(buffer_conv)
+    if buffer_conv := passthrough_buffer(buffer, ftex, conv_fmt, conv_ver, path):
+        write_converted(path, buffer_conv, dont_preserve_original)
+        return conversion_result(filename, ftex, buffer_conv)
+
+    if cache is not None:
+        cache_key = conversion_cache_key(
+            buffer, path, conv_fmt, conv_ver, profile, engine, dedup
+        )
+        buffer_conv = cache.get(cache_key)
     else:
-        dds_buffer = ftex_to_dds_buffer(buffer)
-        match conv_fmt:
-            case "BC1":
-                conv_fmt = "DXT1"
-            case "BC2":
-                conv_fmt = "DXT3"
-            case "BC3":
-                conv_fmt = "DXT5"
-
-        if sys.platform == "win32":
-            dds_path = path.replace(".ftex", "_tmp.dds")
-            with open(dds_path, "wb") as df:
-                df.write(dds_buffer)
-
-            cmd = [
-                os.path.join("bin", "texconv.exe"),
-                "-f",
-                conv_fmt,
-                "-y",
-                "-o",
-                filedir,
-                dds_path,
-            ]
-            check_output(cmd)
-
-            with open(dds_path, "rb") as dcf:
-                dds_converted_buffer = dcf.read()
-
-            if not keep_dds_file:
-                os.remove(dds_path)
-        else:
-            cmd = [
-                "convert",
-                "-format",
-                "dds",
-                "-define",
-                f"dds:compression={conv_fmt.lower()}",
-                "-",
-                "-",
-            ]
-            proc = Popen(
-                cmd,
-                stdin=PIPE,
-                stdout=PIPE,
-                stderr=PIPE,
+        buffer_conv = None
+
+    if buffer_conv is None:
+        buffer_conv = convert_buffer(
+            buffer,
+            conv_fmt,
+            conv_ver,
+            path,
+            filedir,
+            keep_dds_file,
+            profile,
+            engine,
+            dedup,
+        )
+        if cache is not None:
+            cache.put(cache_key, buffer_conv)
+
+    write_converted(path, buffer_conv, dont_preserve_original)
+
+    return conversion_result(filename, ftex, buffer_conv, dedup)
+
+
+def retag_version(
+    path: str,
+    filename: str,
+    chk_fmt: list[str],
+    chk_ver: float,
+    conv_ver: float,
+    dont_preserve_original: bool,
+) -> str | None:
+    # Version-only conversions leave the payload alone, so only the header is
+    # read and the version field is patched in place. The patch is checked
+    # before the original is backed up, so a refused retag leaves nothing
+    # behind.
+    header = read_header(path)
+    if not (ftex := ftex_check(header, chk_fmt, chk_ver)):
+        return
+    if conv_ver == round(ftex.version, 2):
+        return
+
+    check_version_patch(header, conv_ver)
+    if not dont_preserve_original:
+        shutil.copyfile(path, path.replace(".ftex", "_old.ftex"))
+    patch_ftex_version(path, conv_ver)
+
+    return conversion_result(filename, ftex, read_header(path))
+
+
+def _convert_job(path: str, kwargs: dict) -> tuple[str, str | None, str | None]:
+    try:
+        return path, check_and_convert(path, **kwargs), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def _profiled_job(
+    path: str, kwargs: dict, profiler: StageProfiler = None
+) -> tuple[str, str | None, str | None]:
+    with file_context(profiler, path):
+        return _convert_job(path, kwargs)
+
+
+def _convert_pool_job(
+    path: str, kwargs: dict, profiler: StageProfiler = None
+) -> tuple[tuple, dict | None, list | None]:
+    # Worker processes get their own copy of the cache and of the profiler, so
+    # their counters and records are sent back with the result and merged in
+    # the parent.
+    cache = kwargs.get("cache")
+    if profiler is None:
+        return _convert_job(path, kwargs), cache.stats() if cache else None, None
+
+    set_profile_hook(profiler.record)
+    try:
+        result = _profiled_job(path, kwargs, profiler)
+    finally:
+        set_profile_hook(None)
+    return result, cache.stats() if cache else None, profiler.records
+
+
+def file_context(profiler: StageProfiler | None, path: str):
+    # Attributes the stages reported by the current thread to path.
+    return profiler.file(path) if profiler is not None else nullcontext()
+
+
+def find_ftex_files(path: str) -> list[str]:
+    paths = []
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            if file.split(".")[-1].lower() == "ftex":
+                paths.append(os.path.join(root, file))
+    return paths
+
+
+def iter_convert(
+    paths: Iterable[str],
+    jobs: int = 1,
+    keep_order: bool = False,
+    profiler: StageProfiler = None,
+    **kwargs,
+) -> Iterator[tuple[str, str | None, str | None]]:
+    # Yields (path, result, error) for every file. A failing file is reported
+    # through its error message instead of stopping the whole batch.
+    paths = list(paths)
+    if jobs <= 1:
+        for path in paths:
+            yield _profiled_job(path, kwargs, profiler)
+        return
+
+    if not kwargs.get("conv_fmt"):
+        # Retagging only touches file headers, which threads handle fine.
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            yield from executor.map(
+                _profiled_job, paths, repeat(kwargs), repeat(profiler)
             )
-            dds_converted_buffer, p_err = proc.communicate(dds_buffer)
+        return
 
-            if p_err:
-                raise Exception(p_err.decode("utf-8"))
+    cache = kwargs.get("cache")
+    for result, cache_stats, records in run_largest_first(
+        _convert_pool_job,
+        [(path, kwargs, profiler) for path in paths],
+        jobs,
+        keep_order,
+    ):
+        if cache_stats:
+            cache.merge_stats(cache_stats)
+        if records:
+            profiler.merge(records)
+        yield result
 
-        if not dont_preserve_original:
-            os.rename(path, path.replace(".ftex", "_old.ftex"))
 
-        buffer_conv = dds_to_ftex_buffer(dds_converted_buffer)
+def _finish_batch_item(item: tuple, dds_converted_buffer: bytes, kwargs: dict) -> str:
+    path, ftex, cache_key = item[:3]
+    if kwargs["keep_dds_file"]:
+        with open(path.replace(".ftex", "_tmp.dds"), "wb") as df:
+            df.write(dds_converted_buffer)
 
-        if conv_ver != round(ftex.version, 2):
-            ftex203 = b"\x85\xeb\x01@"
-            ftex204 = b"\\\x8f\x02@"
-            match conv_ver:
-                case 2.03:
-                    buffer_conv = buffer_conv.replace(ftex204, ftex203)
-                case 2.04:
-                    buffer_conv = buffer_conv.replace(ftex203, ftex204)
+    buffer_conv = finish_buffer(
+        dds_converted_buffer,
+        kwargs["conv_ver"],
+        kwargs["profile"],
+        kwargs["dedup"],
+    )
+    if cache_key is not None:
+        kwargs["cache"].put(cache_key, buffer_conv)
 
-        with open(path, "wb") as output_buffer:
-            output_buffer.write(buffer_conv)
+    write_converted(path, buffer_conv, kwargs["dont_preserve_original"])
+    return conversion_result(path, ftex, buffer_conv, kwargs["dedup"])
 
-    ftex_conv = FtexHeader(buffer_conv)
 
-    return (
-        f"Converting: {filename}\n"
-        f"FTEX VERSION {round(ftex.version, 2)} "
-        f"FORMAT {ftex_fmt_str[ftex.pixel_fmt]} > "
-        f"FTEX VERSION {round(ftex_conv.version, 2)} "
-        f"FORMAT {ftex_fmt_str[ftex_conv.pixel_fmt]}"
+def _collect_batch(
+    batch: list[tuple],
+    future: Future,
+    converter: ExternalConverter,
+    kwargs: dict,
+    profiler: StageProfiler = None,
+) -> Iterator[tuple[str, str | None, str | None]]:
+    conv_fmt = texconv_format(kwargs["conv_fmt"])
+    try:
+        results = zip(batch, future.result())
+    except Exception:
+        # One bad texture fails the whole invocation, so the batch is run
+        # again one file at a time to find out which one it was.
+        results = []
+        for item in batch:
+            try:
+                results.append((item, converter.convert([item[3]], conv_fmt)[0]))
+            except Exception as e:
+                yield item[0], None, f"{type(e).__name__}: {e}"
+
+    for item, dds_converted_buffer in results:
+        try:
+            with file_context(profiler, item[0]):
+                result = _finish_batch_item(item, dds_converted_buffer, kwargs)
+            yield item[0], result, None
+        except Exception as e:
+            yield item[0], None, f"{type(e).__name__}: {e}"
+
+
+def iter_convert_batched(
+    paths: Iterable[str],
+    converter: ExternalConverter,
+    batch_size: int = 32,
+    profiler: StageProfiler = None,
+    jobs: int = 1,
+    **kwargs,
+) -> Iterator[tuple[str, str | None, str | None]]:
+    # Like iter_convert, but texconv or ImageMagick is started once per batch
+    # of files instead of once per file. Reading, decoding and re-encoding
+    # stay in this process while the converter processes run. Jobs only
+    # applies when there is nothing to batch and iter_convert takes over.
+    if not kwargs["conv_fmt"] or kwargs.get("engine", "external") != "external":
+        yield from iter_convert(paths, jobs, profiler=profiler, **kwargs)
+        return
+
+    cache = kwargs.get("cache")
+    chk_fmt = [kwargs["chk_fmt"]] if kwargs["chk_fmt"] else []
+    conv_fmt = texconv_format(kwargs["conv_fmt"])
+    pending = deque()
+    batch = []
+
+    def submit_batch():
+        pending.append(
+            (batch[:], converter.submit([item[3] for item in batch], conv_fmt))
+        )
+        batch.clear()
+
+    for path in paths:
+        try:
+            with file_context(profiler, path):
+                buffer = read_file(path)
+            if not (ftex := ftex_check(buffer, chk_fmt, kwargs["chk_ver"])):
+                yield path, None, None
+                continue
+
+            with file_context(profiler, path):
+                buffer_conv = passthrough_buffer(
+                    buffer, ftex, kwargs["conv_fmt"], kwargs["conv_ver"], path
+                )
+                if buffer_conv:
+                    write_converted(path, buffer_conv, kwargs["dont_preserve_original"])
+            if buffer_conv:
+                yield path, conversion_result(path, ftex, buffer_conv), None
+                continue
+
+            cache_key = None
+            if cache is not None:
+                cache_key = conversion_cache_key(
+                    buffer,
+                    path,
+                    kwargs["conv_fmt"],
+                    kwargs["conv_ver"],
+                    kwargs["profile"],
+                    "external",
+                    kwargs["dedup"],
+                )
+                if (buffer_conv := cache.get(cache_key)) is not None:
+                    with file_context(profiler, path):
+                        write_converted(
+                            path, buffer_conv, kwargs["dont_preserve_original"]
+                        )
+                    result = conversion_result(path, ftex, buffer_conv, kwargs["dedup"])
+                    yield path, result, None
+                    continue
+
+            with file_context(profiler, path), FtexsFiles(path) as ftexs:
+                dds_buffer = ftex_to_dds_buffer(buffer, ftexs=ftexs)
+            batch.append((path, ftex, cache_key, dds_buffer))
+        except Exception as e:
+            yield path, None, f"{type(e).__name__}: {e}"
+            continue
+
+        if len(batch) >= batch_size:
+            submit_batch()
+        # Two batches per converter process keep them all busy without
+        # holding every decoded texture in memory at once.
+        while len(pending) > converter.processes * 2:
+            yield from _collect_batch(*pending.popleft(), converter, kwargs, profiler)
+
+    if batch:
+        submit_batch()
+    while pending:
+        yield from _collect_batch(*pending.popleft(), converter, kwargs, profiler)
+
+
+def iter_convert_pipelined(
+    paths: Iterable[str],
+    readers: int = 2,
+    workers: int = 1,
+    writers: int = 1,
+    queue_size: int = 8,
+    profiler: StageProfiler = None,
+    **kwargs,
+) -> Iterator[tuple[str, str | None, str | None]]:
+    # Like iter_convert, but reading, converting and writing are separate
+    # stages with their own threads, so that disk I/O overlaps with the zlib
+    # work and the converter. The queues between stages hold at most
+    # queue_size textures, which bounds memory use.
+    if not kwargs["conv_fmt"]:
+        yield from iter_convert(paths, workers, profiler=profiler, **kwargs)
+        return
+
+    cache = kwargs.get("cache")
+    chk_fmt = [kwargs["chk_fmt"]] if kwargs["chk_fmt"] else []
+
+    def read(path: str) -> tuple | None:
+        with file_context(profiler, path):
+            buffer = read_file(path)
+        if not (ftex := ftex_check(buffer, chk_fmt, kwargs["chk_ver"])):
+            return None
+
+        cache_key = buffer_conv = None
+        if cache is not None:
+            cache_key = conversion_cache_key(
+                buffer,
+                path,
+                kwargs["conv_fmt"],
+                kwargs["conv_ver"],
+                kwargs["profile"],
+                kwargs["engine"],
+                kwargs["dedup"],
+            )
+            buffer_conv = cache.get(cache_key)
+        return path, buffer, ftex, cache_key, buffer_conv
+
+    def convert(state: tuple) -> tuple:
+        with file_context(profiler, state[0]):
+            return convert_state(state)
+
+    def convert_state(state: tuple) -> tuple:
+        path, buffer, ftex, cache_key, buffer_conv = state
+        if buffer_conv is not None:
+            return path, ftex, None, buffer_conv
+
+        if buffer_conv := passthrough_buffer(
+            buffer, ftex, kwargs["conv_fmt"], kwargs["conv_ver"], path
+        ):
+            return path, ftex, None, buffer_conv
+
+        buffer_conv = convert_buffer(
+            buffer,
+            kwargs["conv_fmt"],
+            kwargs["conv_ver"],
+            path,
+            os.path.dirname(path),
+            kwargs["keep_dds_file"],
+            kwargs["profile"],
+            kwargs["engine"],
+            kwargs["dedup"],
+        )
+        return path, ftex, cache_key, buffer_conv
+
+    def write(state: tuple) -> str:
+        path, ftex, cache_key, buffer_conv = state
+        if cache_key is not None:
+            cache.put(cache_key, buffer_conv)
+        with file_context(profiler, path):
+            write_converted(path, buffer_conv, kwargs["dont_preserve_original"])
+        return conversion_result(path, ftex, buffer_conv, kwargs["dedup"])
+
+    yield from run_pipeline(
+        paths,
+        [(read, readers), (convert, workers), (write, writers)],
+        queue_size,
     )
 
 
@@ -143,6 +649,37 @@ if __name__ == "__main__":
     )
     parser.add_argument("--dont-preserve-original", action="store_true")
     parser.add_argument("--keep-dds-file", action="store_true")
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--keep-order", action="store_true")
+    parser.add_argument(
+        "--compression", dest="profile", choices=compression_profiles, default="max"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["external", "numpy"],
+        default="external",
+        help="numpy encodes in-process and needs numpy installed (pip install numpy)",
+    )
+    parser.add_argument("--dedup", action="store_true")
+    parser.add_argument("--cache-dir")
+    parser.add_argument("--cache-size", type=int, default=1024, help="in MiB")
+    parser.add_argument("--batch", type=int, default=0, help="files per invocation")
+    parser.add_argument("--scratch-dir")
+    parser.add_argument(
+        "--pipeline", action="store_true", help="overlap reads, conversions and writes"
+    )
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--writers", type=int, default=1)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument(
+        "--profile",
+        dest="profile_stages",
+        action="store_true",
+        help="print per-stage timings as JSON",
+    )
+    parser.add_argument(
+        "--from-list", action="store_true", help="path is a file listing ftex paths"
+    )
     args = parser.parse_args()
 
     if not (args.conv_fmt or args.conv_ver):
@@ -151,8 +688,16 @@ if __name__ == "__main__":
     if args.conv_ver == 2.03 and args.conv_fmt in fmt_choices[6:-1]:
         print(f"{args.conv_fmt} is not compatible with FTEX {args.conv_ver}.")
         exit(1)
-    if sys.platform != "win32":
-        if args.conv_fmt and check_output(["whereis", "convert"]) == b"convert:\n":
+    if args.engine == "numpy":
+        if args.conv_fmt in fmt_choices[6:-1]:
+            print(
+                "Conversion to BC4, BC5, BC6 and BC7 is not supported by the numpy engine."
+            )
+            exit(1)
+    elif sys.platform != "win32":
+        # Batches go through mogrify, single files through convert.
+        batched = args.batch > 0 and (args.from_list or os.path.isdir(args.path))
+        if args.conv_fmt and not shutil.which("mogrify" if batched else "convert"):
             print("ImageMagick has not been found...")
             print("Please install it with your package manager.")
             exit(1)
@@ -162,12 +707,80 @@ if __name__ == "__main__":
 
     kwargs = copy.copy(vars(args))
     del kwargs["path"]
+    del kwargs["jobs"]
+    del kwargs["keep_order"]
+    del kwargs["cache_dir"]
+    del kwargs["cache_size"]
+    del kwargs["batch"]
+    del kwargs["scratch_dir"]
+    del kwargs["from_list"]
+    del kwargs["pipeline"]
+    del kwargs["readers"]
+    del kwargs["writers"]
+    del kwargs["queue_size"]
+    del kwargs["profile_stages"]
+    if args.cache_dir:
+        kwargs["cache"] = ConversionCache(args.cache_dir, args.cache_size << 20)
+
+    profiler = None
+    if args.profile_stages:
+        profiler = StageProfiler()
+        set_profile_hook(profiler.record)
+
+    errors = []
+    if args.from_list or os.path.isdir(args.path):
+        if args.from_list:
+            with open(args.path) as list_file:
+                paths = [line.strip() for line in list_file if line.strip()]
+        else:
+            paths = find_ftex_files(args.path)
+
+        if args.batch > 0 and args.engine == "external":
+            converter = ExternalConverter(args.jobs, args.scratch_dir)
+            results = iter_convert_batched(
+                paths, converter, args.batch, profiler, args.jobs, **kwargs
+            )
+        elif args.pipeline:
+            converter = None
+            results = iter_convert_pipelined(
+                paths,
+                args.readers,
+                args.jobs,
+                args.writers,
+                args.queue_size,
+                profiler,
+                **kwargs,
+            )
+        else:
+            converter = None
+            results = iter_convert(
+                paths, args.jobs, args.keep_order, profiler, **kwargs
+            )
+
+        for path, result, error in results:
+            if error:
+                errors.append((path, error))
+            elif result:
+                print(result)
+
+        if converter is not None:
+            converter.close()
 
-    if os.path.isdir(args.path):
-        for root, dirs, files in os.walk(args.path):
-            for file in files:
-                if result := check_and_convert(file, filedir=root, **kwargs):
-                    print(result)
+        if errors:
+            print(f"\n{len(errors)} file(s) failed to convert:")
+            for path, error in errors:
+                print(f"{path}\n{error}")
     else:
-        if result := check_and_convert(args.path, **kwargs):
+        with file_context(profiler, args.path):
+            result = check_and_convert(args.path, **kwargs)
+        if result:
             print(result)
+
+    if cache := kwargs.get("cache"):
+        print(cache.report())
+
+    if profiler is not None:
+        print(json.dumps(profiler.summary(), indent=2))
+
+    if errors:
+        exit(1)
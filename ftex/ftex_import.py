@@ -0,0 +1,177 @@
+import argparse
+import os
+import sys
+from fnmatch import fnmatch
+from typing import Iterable, Iterator
+
+from lib.ftex import compression_profiles, dds_to_ftex
+from lib.pipeline import run_largest_first
+
+color_spaces = ["LINEAR", "SRGB", "NORMAL"]
+
+
+def parse_rule(rule: str) -> tuple[str, str]:
+    # A rule is PATTERN=COLORSPACE. The pattern is a glob matched against the
+    # path relative to the import root, or a directory that applies to
+    # everything below it.
+    pattern, _, color_space = rule.rpartition("=")
+    color_space = color_space.upper()
+    if not pattern or color_space not in color_spaces:
+        raise argparse.ArgumentTypeError(f"invalid rule: {rule}")
+    return pattern.replace("\\", "/").strip("/"), color_space
+
+
+def rule_color_space(
+    relative_path: str, rules: list[tuple[str, str]], default: str
+) -> str:
+    # The first matching rule wins.
+    relative_path = relative_path.replace(os.sep, "/")
+    for pattern, color_space in rules:
+        if fnmatch(relative_path, pattern) or relative_path.startswith(pattern + "/"):
+            return color_space
+    return default
+
+
+def find_dds_files(path: str) -> list[str]:
+    paths = []
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            if file.split(".")[-1].lower() == "dds":
+                paths.append(os.path.join(root, file))
+    return paths
+
+
+def output_path(path: str, root: str, output_dir: str = None) -> str:
+    ftex_path = os.path.splitext(path)[0] + ".ftex"
+    if output_dir is None:
+        return ftex_path
+    return os.path.join(output_dir, os.path.relpath(ftex_path, root))
+
+
+def is_up_to_date(path: str, ftex_path: str) -> bool:
+    try:
+        return os.path.getmtime(ftex_path) >= os.path.getmtime(path)
+    except OSError:
+        return False
+
+
+def import_dds(
+    path: str,
+    ftex_path: str,
+    color_space: str,
+    profile: str = "max",
+    dedup: bool = False,
+) -> str:
+    # The ftex is encoded next to its final path and renamed into place, so
+    # that an interrupted import never leaves a partial file that looks up to
+    # date.
+    os.makedirs(os.path.dirname(ftex_path) or ".", exist_ok=True)
+    tmp_path = ftex_path + ".tmp"
+    try:
+        dds_to_ftex(path, tmp_path, color_space, 1, profile, dedup)
+        os.replace(tmp_path, ftex_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return f"{path} -> {ftex_path} ({color_space})"
+
+
+def _import_job(
+    path: str, ftex_path: str, color_space: str, profile: str, dedup: bool
+) -> tuple[str, str | None, str | None]:
+    try:
+        return path, import_dds(path, ftex_path, color_space, profile, dedup), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def iter_import(
+    paths: Iterable[str],
+    root: str,
+    output_dir: str = None,
+    rules: list[tuple[str, str]] = (),
+    default_color_space: str = "NORMAL",
+    jobs: int = 1,
+    force: bool = False,
+    profile: str = "max",
+    dedup: bool = False,
+) -> Iterator[tuple[str, str | None, str | None]]:
+    # Yields (path, result, error) for every dds that needed importing. Files
+    # whose ftex is at least as recent as the dds are skipped unless forced.
+    tasks = []
+    for path in paths:
+        ftex_path = output_path(path, root, output_dir)
+        if not force and is_up_to_date(path, ftex_path):
+            continue
+        color_space = rule_color_space(
+            os.path.relpath(path, root), rules, default_color_space
+        )
+        tasks.append((path, ftex_path, color_space, profile, dedup))
+
+    if jobs <= 1:
+        for task in tasks:
+            yield _import_job(*task)
+        return
+
+    yield from run_largest_first(_import_job, tasks, jobs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="DDS to FTEX Importer")
+    parser.add_argument("path", help="a dds file or a folder of dds files")
+    parser.add_argument("--output-dir", help="mirror the tree here instead")
+    parser.add_argument(
+        "--color-space", choices=color_spaces, default="NORMAL", help="default"
+    )
+    parser.add_argument(
+        "--rule",
+        dest="rules",
+        type=parse_rule,
+        action="append",
+        default=[],
+        metavar="PATTERN=COLORSPACE",
+        help="glob or directory relative to path, first match wins",
+    )
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument(
+        "--compression", dest="profile", choices=compression_profiles, default="max"
+    )
+    parser.add_argument("--dedup", action="store_true")
+    parser.add_argument(
+        "--force", action="store_true", help="also import up to date files"
+    )
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path):
+        root = args.path
+        paths = find_dds_files(args.path)
+    else:
+        root = os.path.dirname(args.path)
+        paths = [args.path]
+
+    errors = []
+    imported = 0
+    for path, result, error in iter_import(
+        paths,
+        root,
+        args.output_dir,
+        args.rules,
+        args.color_space,
+        args.jobs,
+        args.force,
+        args.profile,
+        args.dedup,
+    ):
+        if error:
+            errors.append((path, error))
+        else:
+            imported += 1
+            print(result)
+
+    print(f"{imported} imported, {len(paths) - imported - len(errors)} up to date")
+    if errors:
+        print(f"\n{len(errors)} file(s) failed to import:")
+        for path, error in errors:
+            print(f"{path}\n{error}")
+        sys.exit(1)
@@ -1,7 +1,18 @@
 import argparse
-import io
+import json
 import os
-import struct
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Iterator
+
+from lib.fpk import FpkArchive
+from lib.ftex import report_stage, set_profile_hook
+from lib.index import TextureIndex
+from lib.parser import DecodeError, FtexHeader
+from lib.profiling import StageProfiler
 
 # Pixel formats:
 # (ftex format ID) -- (dds dxgiFormat)
@@ -57,48 +68,36 @@ fmt_choices = [
     "ARGB",
 ]
 
-
-class DecodeError(Exception):
-    pass
-
-
-class FtexHeader:
-    def __init__(self, data_buffer: bytes):
-        input_stream = io.BytesIO(data_buffer)
-        header = bytearray(64)
-
-        if input_stream.readinto(header) != len(header):
-            raise DecodeError("Incomplete ftex header")
-
-        (
-            self.magic,
-            self.version,
-            self.pixel_fmt,
-            self.width,
-            self.height,
-            self.depth,
-            self.mipmap_count,
-            self.nrt,
-            self.flags,
-            self.unknown_1,
-            self.unknown_2,
-            self.texture_type,
-            self.ftexs_count,
-            self.unknown_3,
-            self.hash_1,
-            self.hash_2,
-        ) = struct.unpack("< 4s f HHHH  BB HIII  BB 14x  8s 8s", header)
+# The ftex format ID each of fmt_choices stands for.
+fmt_choice_pixel_fmts = {
+    "DXT1": 2,
+    "DXT3": 3,
+    "DXT5": 4,
+    "BC1": 2,
+    "BC2": 3,
+    "BC3": 4,
+    "BC4": 8,
+    "BC5": 9,
+    "BC6": 10,
+    "BC7": 11,
+    "ARGB": 0,
+}
 
 
 def ftex_check(
     ftex_data: bytes, fmt_chk: list[str], ver_chk: float
 ) -> FtexHeader | None:
     ftex_obj = FtexHeader(ftex_data)
+    if ftex_obj.magic != b"FTEX":
+        raise DecodeError("Incorrect ftex signature")
 
     if fmt_chk or ver_chk:
         ver_pass = ver_chk == round(ftex_obj.version, 2)
         fmt_pass = any(
-            [tex_fmt in ftex_fmt_str[ftex_obj.pixel_fmt] for tex_fmt in fmt_chk]
+            [
+                fmt_choice_pixel_fmts[tex_fmt] == ftex_obj.pixel_fmt
+                for tex_fmt in fmt_chk
+            ]
         )
 
         if not (ver_pass or fmt_pass):
@@ -107,40 +106,178 @@ def ftex_check(
     return ftex_obj
 
 
+def warn_skipped(path: str, error: Exception):
+    # Unreadable and corrupt files are left out of the results, but not
+    # silently.
+    print(f"{path}: skipped, {error or type(error).__name__}", file=sys.stderr)
+
+
+def read_header(path: str) -> bytes:
+    start = time.perf_counter()
+    with open(path, "rb") as fd:
+        header = fd.read(64)
+    report_stage("read", start, len(header), len(header))
+    return header
+
+
+def iter_ftex_paths(path: str) -> Iterator[str]:
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_ftex_paths(entry.path)
+            elif entry.name.split(".")[-1].lower() in ("ftex", "fpk"):
+                yield entry.path
+
+
+def scan_archive(
+    path: str, fmt_chk: list[str], ver_chk: float
+) -> list[tuple[str, FtexHeader]]:
+    # The ftex entries of a .fpk are checked in place, from their first 64
+    # bytes in the mapped archive. They are named <archive>:<entry name>.
+    start = time.perf_counter()
+    results = []
+    with FpkArchive(path) as archive:
+        ftex_entries = archive.ftex_entries()
+        for entry in ftex_entries:
+            with archive.view(entry) as view:
+                try:
+                    ftex = ftex_check(view[:64], fmt_chk, ver_chk)
+                except DecodeError as e:
+                    warn_skipped(f"{path}:{entry.name}", e)
+                    continue
+            if ftex:
+                results.append((f"{path}:{entry.name}", ftex))
+    report_stage("archive", start, 64 * len(ftex_entries), 64 * len(ftex_entries))
+    return results
+
+
+def _scan_file(
+    path: str, fmt_chk: list[str], ver_chk: float, profiler: StageProfiler = None
+) -> list[tuple[str, FtexHeader]]:
+    try:
+        with profiler.file(path) if profiler is not None else nullcontext():
+            if path.split(".")[-1].lower() == "fpk":
+                return scan_archive(path, fmt_chk, ver_chk)
+            if ftex := ftex_check(read_header(path), fmt_chk, ver_chk):
+                return [(path, ftex)]
+    except (OSError, DecodeError) as e:
+        warn_skipped(path, e)
+    return []
+
+
+def scan(
+    path: str,
+    fmt_chk: list[str],
+    ver_chk: float,
+    workers: int = 16,
+    profiler: StageProfiler = None,
+) -> Iterator[tuple[str, FtexHeader]]:
+    # Only the 64 header bytes of each file are read, and .fpk packages are
+    # looked into without extracting them. Opens run concurrently on a thread
+    # pool, with a bounded number of them in flight, and results come back in
+    # walk order.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for ftex_path in iter_ftex_paths(path):
+            pending.append(
+                executor.submit(_scan_file, ftex_path, fmt_chk, ver_chk, profiler)
+            )
+            if len(pending) >= workers * 4:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog="FTEX Info Gatherer")
     parser.add_argument("path")
     parser.add_argument("--check-format", choices=fmt_choices, default=[], nargs="*")
     parser.add_argument("--check-version", choices=[2.03, 2.04], type=float)
+    parser.add_argument("--jobs", type=int, default=16)
+    parser.add_argument(
+        "--profile", action="store_true", help="print per-stage timings as JSON"
+    )
+    parser.add_argument(
+        "--index",
+        metavar="DATABASE",
+        help="answer from an SQLite metadata index, refreshing changed files first",
+    )
+    parser.add_argument(
+        "--no-refresh",
+        action="store_true",
+        help="query the index as it is, without looking at the files",
+    )
+    parser.add_argument("--min-size", type=int, help="with --index")
+    parser.add_argument("--max-size", type=int, help="with --index")
+    parser.add_argument("--cube", action="store_true", help="with --index")
+    parser.add_argument("--volume", action="store_true", help="with --index")
+    parser.add_argument("--min-ratio", type=float, help="with --index")
+    parser.add_argument("--max-ratio", type=float, help="with --index")
     args = parser.parse_args()
 
-    if os.path.isdir(args.path):
-        for root, dirs, files in os.walk(args.path):
-            for file in files:
-                if file.split(".")[-1].lower() == "ftex":
-                    path = os.path.join(root, file)
-                    with open(path, "rb") as fd:
-                        if not (
-                            ftex := ftex_check(
-                                fd.read(), args.check_format, args.check_version
-                            )
-                        ):
-                            continue
-                        else:
-                            print(
-                                f"{path}\n"
-                                f"FTEX VERSION {round(ftex.version, 2)} "
-                                f"FORMAT {ftex_fmt_str[ftex.pixel_fmt]}"
-                            )
+    profiler = None
+    if args.profile:
+        profiler = StageProfiler()
+        set_profile_hook(profiler.record)
+
+    if args.index:
+        with TextureIndex(args.index) as index:
+            if not args.no_refresh:
+                if os.path.isdir(args.path):
+                    paths = iter_ftex_paths(args.path)
+                else:
+                    paths = [args.path]
+                *_, failures = index.refresh(args.path, paths, args.jobs, profiler)
+                for path, error in failures:
+                    warn_skipped(path, error)
+            rows = index.query(
+                root=args.path,
+                pixel_fmts=(
+                    [fmt_choice_pixel_fmts[tex_fmt] for tex_fmt in args.check_format]
+                    if args.check_format
+                    else None
+                ),
+                version=args.check_version,
+                min_size=args.min_size,
+                max_size=args.max_size,
+                cube=args.cube or None,
+                volume=args.volume or None,
+                min_ratio=args.min_ratio,
+                max_ratio=args.max_ratio,
+            )
+
+        for row in rows:
+            print(
+                f"{row['path']}\n"
+                f"FTEX VERSION {round(row['version'], 2)} "
+                f"FORMAT {ftex_fmt_str.get(row['pixel_fmt'], row['pixel_fmt'])}"
+            )
+    elif os.path.isdir(args.path) or args.path.split(".")[-1].lower() == "fpk":
+        if os.path.isdir(args.path):
+            results = scan(
+                args.path, args.check_format, args.check_version, args.jobs, profiler
+            )
+        else:
+            with profiler.file(args.path) if profiler is not None else nullcontext():
+                results = scan_archive(args.path, args.check_format, args.check_version)
+
+        for path, ftex in results:
+            print(
+                f"{path}\n"
+                f"FTEX VERSION {round(ftex.version, 2)} "
+                f"FORMAT {ftex_fmt_str[ftex.pixel_fmt]}"
+            )
     else:
-        with open(args.path, "rb") as fd:
-            if not (
-                ftex := ftex_check(fd.read(), args.check_format, args.check_version)
-            ):
-                exit(0)
-            else:
-                print(
-                    f"{args.path}\n"
-                    f"FTEX VERSION {round(ftex.version, 2)} "
-                    f"FORMAT {ftex_fmt_str[ftex.pixel_fmt]}"
-                )
+        with profiler.file(args.path) if profiler is not None else nullcontext():
+            ftex = ftex_check(
+                read_header(args.path), args.check_format, args.check_version
+            )
+        if ftex:
+            print(
+                f"{args.path}\n"
+                f"FTEX VERSION {round(ftex.version, 2)} "
+                f"FORMAT {ftex_fmt_str[ftex.pixel_fmt]}"
+            )
+
+    if profiler is not None:
+        print(json.dumps(profiler.summary(), indent=2))
@@ -0,0 +1,82 @@
+import argparse
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+from ftex_info import iter_ftex_paths
+from lib.fpk import FpkArchive
+from lib.ftex import DecodeError, verify_ftex, verify_ftex_buffer
+
+
+def verify_archive(path: str) -> list[tuple[str, str | None]]:
+    # The ftex entries of a .fpk are checked in place, with the .ftexs entries
+    # of the same archive as their companions.
+    results = []
+    with FpkArchive(path) as archive:
+        for entry in archive.ftex_entries():
+            ftexs = archive.ftexs(entry.name)
+            try:
+                with archive.view(entry) as view:
+                    verify_ftex_buffer(view, ftexs)
+                error = None
+            except DecodeError as e:
+                error = str(e)
+            finally:
+                for ftexs_view in ftexs.values():
+                    ftexs_view.release()
+            results.append((f"{path}:{entry.name}", error))
+    return results
+
+
+def _verify_file(path: str) -> list[tuple[str, str | None]]:
+    try:
+        if path.split(".")[-1].lower() == "fpk":
+            return verify_archive(path)
+        verify_ftex(path)
+    except (OSError, DecodeError) as e:
+        return [(path, str(e) or type(e).__name__)]
+    return [(path, None)]
+
+
+def verify(path: str, workers: int = 16) -> Iterator[tuple[str, str | None]]:
+    # Yields (path, error) for every texture, with error None when it passed.
+    # Nothing is decoded into memory, so each check runs in constant space,
+    # and files are checked concurrently since zlib releases the GIL.
+    if not os.path.isdir(path):
+        yield from _verify_file(path)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for ftex_path in iter_ftex_paths(path):
+            pending.append(executor.submit(_verify_file, ftex_path))
+            if len(pending) >= workers * 4:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="FTEX Verifier")
+    parser.add_argument("path")
+    parser.add_argument("--jobs", type=int, default=16)
+    parser.add_argument(
+        "--verbose", action="store_true", help="also list the textures that passed"
+    )
+    args = parser.parse_args()
+
+    passed = 0
+    failed = 0
+    for path, error in verify(args.path, args.jobs):
+        if error is None:
+            passed += 1
+            if args.verbose:
+                print(f"{path}: OK")
+        else:
+            failed += 1
+            print(f"{path}: {error}")
+
+    print(f"{passed} passed, {failed} failed")
+    sys.exit(1 if failed else 0)
@@ -1,5 +1,7 @@
+import io
 import struct
 import zlib
+from typing import BinaryIO, Iterator
 
 
 class DecodeError(Exception):
@@ -64,3 +66,102 @@ def try_decompress(byte_buffer):
 def is_compressed(byte_buffer):
     buffer_compressed = decode_header(byte_buffer)
     return buffer_compressed is not None
+
+
+def iter_decompress(
+    input_stream: BinaryIO, chunk_size: int = 1 << 16
+) -> Iterator[bytes]:
+    # Streaming try_decompress: yields the inflated payload of a WESYS stream
+    # in pieces of at most chunk_size bytes, or the stream itself when it is
+    # not compressed.
+    header = input_stream.read(16)
+    if decode_header(header) is None:
+        if header:
+            yield header
+        while data := input_stream.read(chunk_size):
+            yield data
+        return
+
+    decompressor = zlib.decompressobj()
+    try:
+        while data := input_stream.read(chunk_size):
+            while data:
+                if buffer := decompressor.decompress(data, chunk_size):
+                    yield buffer
+                data = decompressor.unconsumed_tail
+            if decompressor.eof:
+                break
+        if buffer := decompressor.flush():
+            yield buffer
+    except zlib.error:
+        raise DecodeError()
+    if not decompressor.eof:
+        raise DecodeError()
+
+
+def iter_try_compress(
+    input_stream: BinaryIO, size: int, chunk_size: int = 1 << 16
+) -> Iterator[bytes]:
+    # Streaming try_compress over a seekable stream of size bytes. The WESYS
+    # header comes first and holds the compressed size, so compressed pieces
+    # are held until the end, but compression stops as soon as they add up to
+    # more than the raw stream. The stream is then yielded as it is.
+    start = input_stream.tell()
+    compressor = zlib.compressobj()
+    buffers = []
+    size_compressed = 0
+    size_uncompressed = 0
+    while data := input_stream.read(chunk_size):
+        size_uncompressed += len(data)
+        if buffer := compressor.compress(data):
+            buffers.append(buffer)
+            size_compressed += len(buffer)
+            if size_compressed + 16 >= size:
+                break
+    else:
+        buffer = compressor.flush()
+        buffers.append(buffer)
+        size_compressed += len(buffer)
+
+    if size_compressed + 16 < size_uncompressed:
+        yield struct.pack(
+            "< 3B 5s II",
+            0x00,
+            0x10,
+            0x01,
+            "WESYS".encode("UTF-8"),
+            size_compressed,
+            size_uncompressed,
+        )
+        yield from buffers
+        return
+
+    buffers.clear()
+    input_stream.seek(start)
+    while data := input_stream.read(chunk_size):
+        yield data
+
+
+class _ChunkReader(io.RawIOBase):
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            if (chunk := next(self._chunks, None)) is None:
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def open_decompress(input_stream: BinaryIO, chunk_size: int = 1 << 16) -> BinaryIO:
+    # A readable file object over the output of iter_decompress, so that a
+    # WESYS stream can be parsed without ever being fully inflated.
+    return io.BufferedReader(_ChunkReader(iter_decompress(input_stream, chunk_size)))
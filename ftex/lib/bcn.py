@@ -0,0 +1,406 @@
+import io
+
+# numpy is an optional dependency, only needed by ftex_convert's
+# --engine numpy and by FtexTexture.rgba. Install it with pip install numpy.
+import numpy as np
+
+from .ftex import (
+    DecodeError,
+    dds_mipmap_size,
+    encode_dds_header,
+    fmt_blk_cfg,
+    read_dds_header,
+)
+
+# Pixels are grouped into an (N, 16, 4) array of 4x4 blocks, and each step of
+# the block codecs is a vectorised operation over all N blocks. Encoding runs
+# over slabs of at most ENCODE_SLAB_BLOCKS blocks, since its temporaries are
+# several times the size of the blocks and would otherwise grow with the
+# image.
+ENCODE_SLAB_BLOCKS = 16384
+
+
+def _to_blocks(rgba: np.ndarray) -> np.ndarray:
+    # (height, width, 4) pixels to (N, 16, 4) blocks, repeating the last row
+    # and column to fill partial blocks.
+    height, width = rgba.shape[:2]
+    padded_height = (height + 3) // 4 * 4
+    padded_width = (width + 3) // 4 * 4
+    if (padded_height, padded_width) != (height, width):
+        rgba = np.pad(
+            rgba,
+            ((0, padded_height - height), (0, padded_width - width), (0, 0)),
+            mode="edge",
+        )
+    blocks = rgba.reshape(padded_height // 4, 4, padded_width // 4, 4, 4)
+    return blocks.transpose(0, 2, 1, 3, 4).reshape(-1, 16, 4)
+
+
+def _from_blocks(blocks: np.ndarray, width: int, height: int) -> np.ndarray:
+    blocks_high = (height + 3) // 4
+    blocks_wide = (width + 3) // 4
+    rgba = blocks.reshape(blocks_high, blocks_wide, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    rgba = rgba.reshape(blocks_high * 4, blocks_wide * 4, 4)
+    return rgba[:height, :width]
+
+
+def _unpack_565(color: np.ndarray) -> np.ndarray:
+    color = color.astype(np.int32)
+    r = (color >> 11) & 0x1F
+    g = (color >> 5) & 0x3F
+    b = color & 0x1F
+    return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], -1)
+
+
+def _pack_565(rgb: np.ndarray) -> np.ndarray:
+    rgb = np.clip(rgb, 0, 255)
+    r = np.rint(rgb[..., 0] * 31 / 255).astype(np.uint16)
+    g = np.rint(rgb[..., 1] * 63 / 255).astype(np.uint16)
+    b = np.rint(rgb[..., 2] * 31 / 255).astype(np.uint16)
+    return (r << 11) | (g << 5) | b
+
+
+def _color_palette(
+    color0: np.ndarray, color1: np.ndarray, four_color_only: bool
+) -> np.ndarray:
+    # (N, 4, 3) palettes. BC1 blocks with color0 <= color1 use three colours
+    # and transparent black, BC2 and BC3 blocks always use four colours.
+    rgb0 = _unpack_565(color0)
+    rgb1 = _unpack_565(color1)
+    palette = np.empty(color0.shape + (4, 3), np.int32)
+    palette[:, 0] = rgb0
+    palette[:, 1] = rgb1
+    palette[:, 2] = (2 * rgb0 + rgb1 + 1) // 3
+    palette[:, 3] = (rgb0 + 2 * rgb1 + 1) // 3
+    if not four_color_only:
+        three_color = color0 <= color1
+        palette[three_color, 2] = (rgb0[three_color] + rgb1[three_color]) // 2
+        palette[three_color, 3] = 0
+    return palette
+
+
+def _pack_indices(indices: np.ndarray, bits: int) -> np.ndarray:
+    shifts = np.arange(16, dtype=np.uint64) * bits
+    return (indices.astype(np.uint64) << shifts).sum(axis=1, dtype=np.uint64)
+
+
+def _unpack_indices(packed: np.ndarray, bits: int) -> np.ndarray:
+    shifts = np.arange(16, dtype=np.uint64) * bits
+    mask = np.uint64((1 << bits) - 1)
+    return ((packed.astype(np.uint64)[:, None] >> shifts) & mask).astype(np.intp)
+
+
+def _encode_color(
+    rgb: np.ndarray, transparent: np.ndarray, four_color_only: bool
+) -> np.ndarray:
+    # Endpoints are picked along the principal axis of each block's colours,
+    # found with a few rounds of power iteration on the covariance matrix.
+    weights = (~transparent).astype(np.float32)[..., None]
+    count = np.maximum(weights.sum(axis=1), 1)
+    pixels = rgb.astype(np.float32)
+    mean = (pixels * weights).sum(axis=1) / count
+    centered = (pixels - mean[:, None]) * weights
+    covariance = np.einsum("nki,nkj->nij", centered, centered)
+
+    axis = np.ones((len(rgb), 3), np.float32)
+    for _ in range(4):
+        axis = np.einsum("nij,nj->ni", covariance, axis)
+        axis /= np.maximum(np.linalg.norm(axis, axis=1, keepdims=True), 1e-6)
+
+    projection = np.einsum("nki,ni->nk", centered, axis)
+    low = np.where(transparent, np.inf, projection).min(axis=1)
+    high = np.where(transparent, -np.inf, projection).max(axis=1)
+    low = np.where(np.isfinite(low), low, 0)
+    high = np.where(np.isfinite(high), high, 0)
+    color0 = _pack_565(mean + axis * high[:, None])
+    color1 = _pack_565(mean + axis * low[:, None])
+
+    # Four colour blocks need color0 > color1, blocks with transparent pixels
+    # need the three colour mode and so color0 <= color1.
+    if four_color_only:
+        swap = color0 < color1
+    else:
+        punch_through = transparent.any(axis=1)
+        swap = np.where(punch_through, color0 > color1, color0 < color1)
+    color0, color1 = np.where(swap, color1, color0), np.where(swap, color0, color1)
+
+    palette = _color_palette(color0, color1, four_color_only)
+    distance = ((rgb[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=-1)
+    if not four_color_only:
+        distance[color0 <= color1, :, 3] = np.iinfo(np.int32).max
+    indices = distance.argmin(axis=-1)
+    if not four_color_only:
+        indices[transparent] = 3
+
+    output = np.empty((len(rgb), 8), np.uint8)
+    output[:, 0:2] = color0.astype("<u2")[:, None].view(np.uint8)
+    output[:, 2:4] = color1.astype("<u2")[:, None].view(np.uint8)
+    output[:, 4:8] = _pack_indices(indices, 2).astype("<u4")[:, None].view(np.uint8)
+    return output
+
+
+def _decode_color(blocks: np.ndarray, four_color_only: bool) -> np.ndarray:
+    color0 = blocks[:, 0:2].copy().view("<u2")[:, 0]
+    color1 = blocks[:, 2:4].copy().view("<u2")[:, 0]
+    indices = _unpack_indices(blocks[:, 4:8].copy().view("<u4")[:, 0], 2)
+
+    palette = _color_palette(color0, color1, four_color_only)
+    rgba = np.empty((len(blocks), 16, 4), np.uint8)
+    rgba[..., :3] = np.take_along_axis(palette, indices[..., None], axis=1)
+    rgba[..., 3] = 255
+    if not four_color_only:
+        rgba[(indices == 3) & (color0 <= color1)[:, None], 3] = 0
+    return rgba
+
+
+def _alpha_palette(alpha0: np.ndarray, alpha1: np.ndarray) -> np.ndarray:
+    # (N, 8) palettes. alpha0 > alpha1 interpolates six values between the
+    # endpoints, otherwise four values plus 0 and 255.
+    alpha0 = alpha0.astype(np.int32)[:, None]
+    alpha1 = alpha1.astype(np.int32)[:, None]
+    steps = np.arange(1, 7)
+    eight = ((7 - steps) * alpha0 + steps * alpha1 + 3) // 7
+    six = ((5 - steps[:4]) * alpha0 + steps[:4] * alpha1 + 2) // 5
+    six = np.concatenate(
+        [six, np.zeros_like(alpha0), np.full_like(alpha0, 255)], axis=1
+    )
+    interpolated = np.where(alpha0 > alpha1, eight, six)
+    return np.concatenate([alpha0, alpha1, interpolated], axis=1)
+
+
+def _encode_alpha(alpha: np.ndarray) -> np.ndarray:
+    alpha = alpha.astype(np.int32)
+    alpha0 = alpha.max(axis=1)
+    alpha1 = alpha.min(axis=1)
+
+    palette = _alpha_palette(alpha0, alpha1)
+    indices = np.abs(alpha[:, :, None] - palette[:, None, :]).argmin(axis=-1)
+    indices[alpha0 == alpha1] = 0
+
+    output = np.empty((len(alpha), 8), np.uint8)
+    output[:, 0] = alpha0
+    output[:, 1] = alpha1
+    packed = _pack_indices(indices, 3).astype("<u8")[:, None].view(np.uint8)
+    output[:, 2:8] = packed[:, 0:6]
+    return output
+
+
+def _decode_alpha(blocks: np.ndarray) -> np.ndarray:
+    packed = np.zeros((len(blocks), 8), np.uint8)
+    packed[:, 0:6] = blocks[:, 2:8]
+    indices = _unpack_indices(packed.view("<u8")[:, 0], 3)
+    palette = _alpha_palette(blocks[:, 0], blocks[:, 1])
+    return np.take_along_axis(palette, indices, axis=1).astype(np.uint8)
+
+
+def _encode_explicit_alpha(alpha: np.ndarray) -> np.ndarray:
+    nibbles = np.rint(alpha.astype(np.float32) * 15 / 255).astype(np.uint8)
+    return nibbles[:, 0::2] | (nibbles[:, 1::2] << 4)
+
+
+def _decode_explicit_alpha(blocks: np.ndarray) -> np.ndarray:
+    nibbles = np.empty((len(blocks), 16), np.uint8)
+    nibbles[:, 0::2] = blocks & 0x0F
+    nibbles[:, 1::2] = blocks >> 4
+    return nibbles * 17
+
+
+def encode_image_rgba(rgba: np.ndarray, ftex_fmt: int) -> bytes:
+    # Encodes one (height, width, 4) RGBA image, that is one depth slice of a
+    # frame. Float images are expected in the 0..1 range.
+    if rgba.dtype != np.uint8:
+        rgba = np.rint(np.clip(rgba, 0, 1) * 255).astype(np.uint8)
+
+    if ftex_fmt == 0:
+        return rgba[..., [2, 1, 0, 3]].tobytes()
+    if ftex_fmt not in (2, 3, 4):
+        raise DecodeError("Unsupported ftex codec")
+
+    blocks = _to_blocks(rgba)
+    output = np.empty((len(blocks), fmt_blk_cfg[ftex_fmt][1]), np.uint8)
+    for start in range(0, len(blocks), ENCODE_SLAB_BLOCKS):
+        slab = blocks[start : start + ENCODE_SLAB_BLOCKS]
+        slab_output = output[start : start + ENCODE_SLAB_BLOCKS]
+        match ftex_fmt:
+            case 2:
+                slab_output[:] = _encode_color(slab[..., :3], slab[..., 3] < 128, False)
+            case 3:
+                slab_output[:, 0:8] = _encode_explicit_alpha(slab[..., 3])
+                slab_output[:, 8:16] = _encode_color(
+                    slab[..., :3], np.zeros(slab.shape[:2], bool), True
+                )
+            case 4:
+                slab_output[:, 0:8] = _encode_alpha(slab[..., 3])
+                slab_output[:, 8:16] = _encode_color(
+                    slab[..., :3], np.zeros(slab.shape[:2], bool), True
+                )
+    return output.tobytes()
+
+
+def _unpack_small_float(bits: np.ndarray, mantissa_bits: int) -> np.ndarray:
+    # The unsigned 11 and 10 bit floats share the exponent bias of half floats,
+    # so shifting them into the half float layout is enough.
+    return (bits << (10 - mantissa_bits)).astype(np.uint16).view(np.float16)
+
+
+def decode_image_rgba(
+    data: bytes, ftex_fmt: int, width: int, height: int
+) -> np.ndarray:
+    # Decodes one depth slice of a frame to a (height, width, 4) RGBA image.
+    # UNORM formats come out as uint8 and float formats as float32, with
+    # R10G10B10A2 normalised to 0..1. Channels the format lacks are zero,
+    # and alpha is opaque.
+    pixel_count = width * height
+    match ftex_fmt:
+        case 0:
+            bgra = np.frombuffer(data, np.uint8, pixel_count * 4)
+            return bgra.reshape(height, width, 4)[..., [2, 1, 0, 3]]
+        case 1:
+            rgba = np.zeros((height, width, 4), np.uint8)
+            rgba[..., 0] = np.frombuffer(data, np.uint8, pixel_count).reshape(
+                height, width
+            )
+            rgba[..., 3] = 255
+            return rgba
+        case 12:
+            rgba = np.frombuffer(data, "<f2", pixel_count * 4)
+            return rgba.astype(np.float32).reshape(height, width, 4)
+        case 13:
+            rgba = np.frombuffer(data, "<f4", pixel_count * 4)
+            return rgba.astype(np.float32).reshape(height, width, 4)
+        case 14:
+            packed = np.frombuffer(data, "<u4", pixel_count).reshape(height, width)
+            rgba = np.empty((height, width, 4), np.float32)
+            rgba[..., 0] = packed & 0x3FF
+            rgba[..., 1] = (packed >> 10) & 0x3FF
+            rgba[..., 2] = (packed >> 20) & 0x3FF
+            rgba[..., 3] = (packed >> 30) * (1023 / 3)
+            return rgba / 1023
+        case 15:
+            packed = np.frombuffer(data, "<u4", pixel_count).reshape(height, width)
+            rgba = np.empty((height, width, 4), np.float32)
+            rgba[..., 0] = _unpack_small_float(packed & 0x7FF, 6)
+            rgba[..., 1] = _unpack_small_float((packed >> 11) & 0x7FF, 6)
+            rgba[..., 2] = _unpack_small_float(packed >> 22, 5)
+            rgba[..., 3] = 1
+            return rgba
+
+    if ftex_fmt not in (2, 3, 4, 8, 9):
+        raise DecodeError("Unsupported ftex codec")
+
+    block_count = ((width + 3) // 4) * ((height + 3) // 4)
+    blocks = np.frombuffer(data, np.uint8, block_count * fmt_blk_cfg[ftex_fmt][1])
+    match ftex_fmt:
+        case 2:
+            rgba = _decode_color(blocks.reshape(-1, 8), False)
+        case 3:
+            blocks = blocks.reshape(-1, 16)
+            rgba = _decode_color(blocks[:, 8:16], True)
+            rgba[..., 3] = _decode_explicit_alpha(blocks[:, 0:8])
+        case 4:
+            blocks = blocks.reshape(-1, 16)
+            rgba = _decode_color(blocks[:, 8:16], True)
+            rgba[..., 3] = _decode_alpha(blocks[:, 0:8])
+        case 8:
+            rgba = np.zeros((block_count, 16, 4), np.uint8)
+            rgba[..., 0] = _decode_alpha(blocks.reshape(-1, 8))
+            rgba[..., 3] = 255
+        case 9:
+            blocks = blocks.reshape(-1, 16)
+            rgba = np.zeros((block_count, 16, 4), np.uint8)
+            rgba[..., 0] = _decode_alpha(blocks[:, 0:8])
+            rgba[..., 1] = _decode_alpha(blocks[:, 8:16])
+            rgba[..., 3] = 255
+    return _from_blocks(rgba, width, height)
+
+
+def decode_frame(
+    frame: bytes, ftex_fmt: int, width: int, height: int, depth: int = 1
+) -> np.ndarray:
+    # Decodes a whole frame to a (depth, height, width, 4) RGBA array.
+    slice_size = dds_mipmap_size(ftex_fmt, width, height, 1, 0)
+    if len(frame) < slice_size * depth:
+        raise DecodeError("Unexpected end of frame")
+    view = memoryview(frame)
+    return np.stack(
+        [
+            decode_image_rgba(
+                view[slice_size * i : slice_size * (i + 1)], ftex_fmt, width, height
+            )
+            for i in range(depth)
+        ]
+    )
+
+
+def encode_frame(rgba: np.ndarray, ftex_fmt: int) -> bytes:
+    return b"".join(encode_image_rgba(image, ftex_fmt) for image in rgba)
+
+
+def convert_dds(dds_buffer: bytes, ftex_fmt: int) -> bytes:
+    # Re-encodes every frame of a DDS texture to another pixel format,
+    # keeping its dimensions, mipmaps and cube faces.
+    input_stream = io.BytesIO(dds_buffer)
+    (
+        source_fmt,
+        width,
+        height,
+        depth,
+        mipmap_count,
+        is_cube_map,
+    ) = read_dds_header(input_stream)
+
+    frames = [
+        encode_dds_header(ftex_fmt, width, height, depth, mipmap_count, is_cube_map)
+    ]
+    for _ in range(6 if is_cube_map else 1):
+        for mipmap_index in range(mipmap_count):
+            length = dds_mipmap_size(source_fmt, width, height, depth, mipmap_index)
+            frame = input_stream.read(length)
+            if len(frame) != length:
+                raise DecodeError("Unexpected end of dds stream")
+
+            rgba = decode_frame(
+                frame,
+                source_fmt,
+                max(width >> mipmap_index, 1),
+                max(height >> mipmap_index, 1),
+                max(depth >> mipmap_index, 1),
+            )
+            frames.append(encode_frame(rgba, ftex_fmt))
+    return b"".join(frames)
+
+
+def decode_dds(dds_buffer: bytes, face: int = 0, mipmap_index: int = 0) -> np.ndarray:
+    # Decodes a single frame of a DDS texture, such as the output of
+    # ftex_to_dds_buffer, to a (depth, height, width, 4) RGBA array. Only that
+    # frame is read.
+    input_stream = io.BytesIO(dds_buffer)
+    (
+        ftex_fmt,
+        width,
+        height,
+        depth,
+        mipmap_count,
+        is_cube_map,
+    ) = read_dds_header(input_stream)
+    if not 0 <= face < (6 if is_cube_map else 1):
+        raise IndexError("Face out of range")
+    if not 0 <= mipmap_index < mipmap_count:
+        raise IndexError("Mipmap out of range")
+
+    mipmap_sizes = [
+        dds_mipmap_size(ftex_fmt, width, height, depth, i) for i in range(mipmap_count)
+    ]
+    offset = (
+        input_stream.tell()
+        + face * sum(mipmap_sizes)
+        + sum(mipmap_sizes[:mipmap_index])
+    )
+    frame = memoryview(dds_buffer)[offset : offset + mipmap_sizes[mipmap_index]]
+    return decode_frame(
+        frame,
+        ftex_fmt,
+        max(width >> mipmap_index, 1),
+        max(height >> mipmap_index, 1),
+        max(depth >> mipmap_index, 1),
+    )
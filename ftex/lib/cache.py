@@ -0,0 +1,151 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+# mkstemp creates files readable by their owner only. Entries get the mode a
+# plain open would have given them instead, so that a cache directory can be
+# shared between users. The umask can only be read by setting it, which is
+# done once, at import.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+class ConversionCache:
+    # Content-addressed store of conversion outputs. Entries are plain files
+    # named after the hash of the input and the conversion parameters, and the
+    # modification time of an entry is bumped on every hit so that eviction can
+    # drop the least recently used ones first.
+    def __init__(self, directory: str, max_size: int = 1 << 30):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_added = 0
+        self._size = None
+        self._worker = False
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self) -> dict:
+        # Copies sent to other processes start with fresh counters, so that
+        # their stats can be merged back as they are. They leave the size
+        # accounting and eviction to the parent, which gets the bytes they
+        # added through merge_stats, so the cache is only walked once.
+        state = self.__dict__.copy()
+        state.update(hits=0, misses=0, bytes_saved=0, bytes_added=0, _worker=True)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(buffer: bytes, *params) -> str:
+        digest = hashlib.sha256(buffer)
+        for param in params:
+            digest.update(b"\0" + str(param).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fd:
+                buffer = fd.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.bytes_saved += len(buffer)
+        return buffer
+
+    def put(self, key: str, buffer: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Written next to the final path and renamed into place, so that other
+        # processes sharing the cache never see a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as output_buffer:
+                output_buffer.write(buffer)
+            os.chmod(tmp_path, 0o666 & ~_UMASK)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        if self._worker:
+            self.bytes_added += len(buffer)
+        else:
+            self._account(len(buffer))
+
+    def _account(self, bytes_added: int):
+        # Writer threads of the pipeline put entries concurrently.
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._entries())
+            else:
+                self._size += bytes_added
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self) -> list[tuple[str, float, int]]:
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        entries = self._entries()
+        size = sum(size for _, _, size in entries)
+        for path, _, entry_size in sorted(entries, key=lambda entry: entry[1]):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self._size = size
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+            "bytes_added": self.bytes_added,
+        }
+
+    def merge_stats(self, stats: dict):
+        self.hits += stats["hits"]
+        self.misses += stats["misses"]
+        self.bytes_saved += stats["bytes_saved"]
+        if stats["bytes_added"]:
+            self._account(stats["bytes_added"])
+
+    def report(self) -> str:
+        return (
+            f"Cache: {self.hits} hit(s), {self.misses} miss(es), "
+            f"{self.bytes_saved / (1 << 20):.2f} MiB saved"
+        )
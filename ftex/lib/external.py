@@ -0,0 +1,115 @@
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .ftex import report_stage
+
+
+def default_scratch_dir() -> str:
+    # Intermediate files are only read back once, so a RAM-backed tmpfs is
+    # preferred where there is one.
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+class ExternalConverter:
+    # Runs texconv on Windows and ImageMagick elsewhere over whole batches of
+    # DDS files: one process converts many files, and at most `processes`
+    # of them run at the same time. All intermediates are staged in a single
+    # scratch directory that is removed on close.
+    def __init__(
+        self,
+        processes: int = None,
+        scratch_dir: str = None,
+        texconv_path: str = os.path.join("bin", "texconv.exe"),
+    ):
+        self.processes = processes or os.cpu_count() or 1
+        self.texconv_path = texconv_path
+        self._executor = ThreadPoolExecutor(max_workers=self.processes)
+        self._scratch = tempfile.mkdtemp(
+            prefix="ftex_", dir=scratch_dir or default_scratch_dir()
+        )
+        self._batch_ids = itertools.count()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown()
+        shutil.rmtree(self._scratch, ignore_errors=True)
+
+    def _command(self, conv_fmt: str, input_paths: list[str], output_dir: str):
+        if sys.platform == "win32":
+            return [
+                self.texconv_path,
+                "-f",
+                conv_fmt,
+                "-y",
+                "-o",
+                output_dir,
+                *input_paths,
+            ]
+        return [
+            "mogrify",
+            "-format",
+            "dds",
+            "-define",
+            f"dds:compression={conv_fmt.lower()}",
+            "-path",
+            output_dir,
+            *input_paths,
+        ]
+
+    def _convert(self, dds_buffers: list[bytes], conv_fmt: str) -> list[bytes]:
+        batch_dir = os.path.join(self._scratch, str(next(self._batch_ids)))
+        input_dir = os.path.join(batch_dir, "in")
+        output_dir = os.path.join(batch_dir, "out")
+        os.makedirs(input_dir)
+        os.makedirs(output_dir)
+
+        start = time.perf_counter()
+        try:
+            # Short names keep the command line well under the Windows limit.
+            input_paths = []
+            for i, dds_buffer in enumerate(dds_buffers):
+                input_path = os.path.join(input_dir, f"{i}.dds")
+                with open(input_path, "wb") as df:
+                    df.write(dds_buffer)
+                input_paths.append(input_path)
+
+            proc = subprocess.run(
+                self._command(conv_fmt, input_paths, output_dir),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            if proc.returncode != 0 or (sys.platform != "win32" and proc.stderr):
+                raise Exception(proc.stderr.decode("utf-8", "replace"))
+
+            dds_converted_buffers = []
+            for i in range(len(dds_buffers)):
+                with open(os.path.join(output_dir, f"{i}.dds"), "rb") as dcf:
+                    dds_converted_buffers.append(dcf.read())
+            report_stage(
+                "convert",
+                start,
+                sum(map(len, dds_buffers)),
+                sum(map(len, dds_converted_buffers)),
+            )
+            return dds_converted_buffers
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+    def submit(self, dds_buffers: list[bytes], conv_fmt: str) -> Future:
+        return self._executor.submit(self._convert, dds_buffers, conv_fmt)
+
+    def convert(self, dds_buffers: list[bytes], conv_fmt: str) -> list[bytes]:
+        return self.submit(dds_buffers, conv_fmt).result()
@@ -0,0 +1,137 @@
+import mmap
+import os
+import struct
+from typing import Iterator, NamedTuple
+
+from .ftex import DecodeError
+
+
+class FpkEntry(NamedTuple):
+    name: str
+    offset: int
+    size: int
+    md5: bytes
+
+
+def read_fpk_index(fpk_buffer: bytes) -> tuple[str, list[FpkEntry]]:
+    # Parses the header and the entry table of a .fpk package and returns its
+    # type ("" or "d") with the list of its entries. The file data itself is
+    # not read.
+    if len(fpk_buffer) < 48:
+        raise DecodeError("Incomplete fpk header")
+
+    (
+        fpk_magic,
+        fpk_type,
+        fpk_platform,
+        fpk_size,
+        fpk_file_count,
+        fpk_reference_count,
+    ) = struct.unpack_from("< 6s c 3s I 18x 4x I I 4x", fpk_buffer)
+
+    if fpk_magic != b"foxfpk" or fpk_platform != b"win":
+        raise DecodeError("Incorrect fpk signature")
+
+    entries = []
+    entry_offset = 48
+    for _ in range(fpk_file_count):
+        if entry_offset + 48 > len(fpk_buffer):
+            raise DecodeError("Incomplete fpk entry")
+        (
+            data_offset,
+            data_size,
+            name_offset,
+            name_length,
+            md5,
+        ) = struct.unpack_from("< I 4x I 4x I 4x i 4x 16s", fpk_buffer, entry_offset)
+        entry_offset += 48
+
+        if name_length < 0 or name_offset + name_length > len(fpk_buffer):
+            raise DecodeError("Unexpected end of stream")
+        if data_offset + data_size > len(fpk_buffer):
+            raise DecodeError("Unexpected end of stream")
+
+        name = bytes(fpk_buffer[name_offset : name_offset + name_length])
+        entries.append(
+            FpkEntry(name.decode("utf-8", "replace"), data_offset, data_size, md5)
+        )
+
+    return fpk_type.strip(b" ").decode(), entries
+
+
+class FpkArchive:
+    # An index over the files of a .fpk package. Nothing is extracted: entries
+    # are handed out as memoryviews over the archive, which is memory-mapped
+    # when opened from a path. Views must be released before closing.
+    def __init__(self, source: bytes | str | os.PathLike | mmap.mmap):
+        self.path = None
+        self._file = None
+        self._map = None
+        if isinstance(source, (str, os.PathLike)):
+            self.path = os.fspath(source)
+            self._file = open(source, "rb")
+            if os.fstat(self._file.fileno()).st_size < 48:
+                self._file.close()
+                raise DecodeError("Incomplete fpk header")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            source = self._map
+
+        self._view = memoryview(source)
+        try:
+            self.fpk_type, self.entries = read_fpk_index(self._view)
+        except BaseException:
+            self.close()
+            raise
+        self._names = {entry.name: entry for entry in self.entries}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[FpkEntry]:
+        return iter(self.entries)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._names
+
+    def __getitem__(self, name: str) -> memoryview:
+        return self.view(self._names[name])
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def view(self, entry: FpkEntry) -> memoryview:
+        return self._view[entry.offset : entry.offset + entry.size]
+
+    def ftex_entries(self) -> list[FpkEntry]:
+        return [
+            entry
+            for entry in self.entries
+            if entry.name.split(".")[-1].lower() == "ftex"
+        ]
+
+    def ftexs(self, name: str) -> dict[int, memoryview]:
+        # The .ftexs companions of an ftex entry that are packed in the same
+        # archive, by ftexs number, in the form ftex_to_dds_buffer takes.
+        stem = name.rsplit(".", 1)[0]
+        ftexs = {}
+        for entry in self.entries:
+            if not entry.name.startswith(stem + "."):
+                continue
+            number, _, extension = entry.name[len(stem) + 1 :].partition(".")
+            if extension.lower() == "ftexs" and number.isdigit():
+                ftexs[int(number)] = self.view(entry)
+        return ftexs
@@ -1,12 +1,49 @@
 import io
+import mmap
+import os
 import struct
+import time
+import traceback
 import zlib
+from concurrent.futures import Executor, ThreadPoolExecutor
+from itertools import repeat
+from typing import Callable
 
-from ._zlib import try_decompress
+from ._zlib import open_decompress
+from .parser import (
+    CHUNK_ENTRY,
+    DecodeError,
+    FtexHeader,
+    MIPMAP_ENTRY,
+    read_chunk_table,
+    read_mipmap_table,
+)
 
+# Called as hook(stage, seconds, bytes_in, bytes_out) at the end of every
+# profiled stage. Profiling is off while it is None.
+_profile_hook = None
 
-class DecodeError(Exception):
-    pass
+
+def set_profile_hook(hook: Callable[[str, float, int, int], None] | None):
+    global _profile_hook
+    _profile_hook = hook
+
+
+def drop_error_frames(error: BaseException | None):
+    # A failed decode leaves memoryviews over its input alive in the frames of
+    # its traceback, and a memory-mapped file cannot be closed until they are
+    # gone. Clearing the locals of those frames, and of the frames of the
+    # errors it was raised from, lets the mapping close under the error while
+    # keeping the error and its traceback.
+    while error is not None:
+        traceback.clear_frames(error.__traceback__)
+        error = error.__context__
+
+
+def report_stage(stage: str, start: float, bytes_in: int, bytes_out: int):
+    # start is the time.perf_counter() value taken when the stage began.
+    if _profile_hook is not None:
+        _profile_hook(stage, time.perf_counter() - start, bytes_in, bytes_out)
 
 
 # Pixel formats:
@@ -85,28 +122,17 @@ def read_image_buffer(
                 raise DecodeError("Unexpected end of stream")
             return zlib.decompress(compressed_buffer)
 
-    chunks = []
-    for i in range(chunk_count):
-        header = bytearray(8)
-        if stream.readinto(header) != len(header):
-            raise DecodeError("Incomplete chunk header")
-        (
-            size_compressed,
-            size_uncompressed,
-            offset,
-        ) = struct.unpack("< HH I", header)
-        is_compressed = size_compressed != size_uncompressed
-        offset &= ~(1 << 31)
-
-        chunks.append((offset, size_compressed, is_compressed))
+    # The whole chunk table is read at once and parsed in a single pass.
+    table_buffer = stream.read(chunk_count * 8)
+    chunks = read_chunk_table(table_buffer, 0, chunk_count)
 
     image_buffers = []
-    for offset, size_compressed, is_compressed in chunks:
-        stream.seek(image_offset + offset, 0)
-        compressed_buffer = bytearray(size_compressed)
+    for chunk in chunks:
+        stream.seek(image_offset + chunk.offset, 0)
+        compressed_buffer = bytearray(chunk.size_compressed)
         if stream.readinto(compressed_buffer) != len(compressed_buffer):
             raise DecodeError("Unexpected end of stream")
-        if is_compressed:
+        if chunk.is_compressed:
             try:
                 decompressed_buffer = zlib.decompress(compressed_buffer)
             except zlib.error:
@@ -117,65 +143,161 @@ def read_image_buffer(
     return b"".join(image_buffers)
 
 
-def ftex_to_dds_buffer(ftex_buffer: bytes) -> bytes:
-    input_stream = io.BytesIO(ftex_buffer)
+def _decompress_chunk(
+    source: memoryview, destination: memoryview, size_uncompressed: int
+) -> None:
+    try:
+        buffer = zlib.decompress(source)
+    except zlib.error:
+        raise DecodeError("Decompression error")
+    if len(buffer) != size_uncompressed:
+        raise DecodeError("Unexpected chunk size")
+    destination[:] = memoryview(buffer)[: len(destination)]
 
-    header = bytearray(64)
-    if input_stream.readinto(header) != len(header):
-        raise DecodeError("Incomplete ftex header")
 
-    (
-        ftex_magic,
-        ftex_version,
-        ftex_pixel_fmt,
-        ftex_width,
-        ftex_height,
-        ftex_depth,
-        ftex_mipmap_count,
-        ftex_nrt,
-        ftex_flags,
-        ftex_unknown1,
-        ftex_unknown2,
-        ftex_texture_type,
-        ftex_ftexs_count,
-        ftex_unknown3,
-        ftex_hash1,
-        ftex_hash2,
-    ) = struct.unpack("< 4s f HHHH  BB HIII  BB 14x  8s 8s", header)
+def read_image_into(
+    source: memoryview,
+    destination: memoryview,
+    image_offset: int,
+    chunk_count: int,
+    size_uncompressed: int,
+    size_compressed: int,
+    executor: Executor = None,
+) -> None:
+    # Decodes an image straight into its final place in the destination view.
+    # Data past the end of the destination is dropped, and whatever the image
+    # does not cover is left untouched, so a zeroed destination gets padded.
+    if chunk_count == 0:
+        if size_compressed == 0:
+            if image_offset + size_uncompressed > len(source):
+                raise DecodeError("Unexpected end of stream")
+            size = min(size_uncompressed, len(destination))
+            destination[:size] = source[image_offset : image_offset + size]
+        else:
+            if image_offset + size_compressed > len(source):
+                raise DecodeError("Unexpected end of stream")
+            try:
+                buffer = zlib.decompress(
+                    source[image_offset : image_offset + size_compressed]
+                )
+            except zlib.error:
+                raise DecodeError("Decompression error")
+            size = min(len(buffer), len(destination))
+            destination[:size] = memoryview(buffer)[:size]
+        return
+
+    # Chunks are laid out back to back in the decoded image, so the table alone
+    # tells where each one ends up.
+    tasks = []
+    position = 0
+    for chunk in read_chunk_table(source, image_offset, chunk_count):
+        start = image_offset + chunk.offset
+        if start + chunk.size_compressed > len(source):
+            raise DecodeError("Unexpected end of stream")
+        data = source[start : start + chunk.size_compressed]
+        target = destination[position : position + chunk.size_uncompressed]
+        position += chunk.size_uncompressed
+        if chunk.is_compressed:
+            tasks.append((data, target, chunk.size_uncompressed))
+        else:
+            target[:] = data[: len(target)]
 
-    if ftex_magic != b"FTEX":
+    if executor is None:
+        for task in tasks:
+            _decompress_chunk(*task)
+    else:
+        # zlib releases the GIL, and every chunk writes to its own region.
+        for future in [executor.submit(_decompress_chunk, *task) for task in tasks]:
+            future.result()
+
+
+def ftex_to_dds_layout(ftex_buffer: bytes) -> tuple[bytes, list[tuple]]:
+    # Only looks at the header and the mipmap table, so this is cheap on a
+    # memory-mapped file.
+    header = FtexHeader(ftex_buffer)
+
+    if header.magic != b"FTEX":
         raise DecodeError("Incorrect ftex signature")
 
-    if ftex_version < 2.025:
+    if header.version < 2.025:
         raise DecodeError("Unsupported ftex version")
-    if ftex_version > 2.045:
+    if header.version > 2.045:
         raise DecodeError("Unsupported ftex version")
-    if ftex_ftexs_count > 0:
-        raise DecodeError("Unsupported ftex variant")
-    if ftex_mipmap_count == 0:
+    if header.mipmap_count == 0:
         raise DecodeError("Unsupported ftex variant")
+    if header.pixel_fmt not in fmt_blk_cfg:
+        raise DecodeError("Unsupported pixel format")
 
+    if header.is_cube_map:
+        # Cube map, with six faces
+        if header.depth > 1:
+            raise DecodeError("Unsupported ftex variant")
+        dds_depth = 1
+    else:
+        dds_depth = header.depth
+
+    mipmap_count = header.mipmap_count
+
+    # A frame is a byte array containing a single mipmap element of a single image.
+    # Cube maps have six images with mipmaps, and so 6 * $mipmapCount frames.
+    # Other textures just have $mipmapCount frames.
+    frame_specifications = []
+    for frame_index, mipmap in enumerate(read_mipmap_table(ftex_buffer, header)):
+        if mipmap.index != frame_index % mipmap_count:
+            raise DecodeError("Unexpected mipmap")
+        if mipmap.ftexs_number > header.ftexs_count:
+            raise DecodeError("Unexpected ftexs number")
+
+        frame_expected_size = dds_mipmap_size(
+            header.pixel_fmt, header.width, header.height, dds_depth, mipmap.index
+        )
+        frame_specifications.append(
+            (
+                mipmap.offset,
+                mipmap.chunk_count,
+                mipmap.size_uncompressed,
+                mipmap.size_compressed,
+                frame_expected_size,
+                mipmap.ftexs_number,
+            )
+        )
+
+    header_buffer = encode_dds_header(
+        header.pixel_fmt,
+        header.width,
+        header.height,
+        dds_depth,
+        mipmap_count,
+        header.is_cube_map,
+    )
+    return header_buffer, frame_specifications
+
+
+def encode_dds_header(
+    ftex_pixel_fmt: int,
+    width: int,
+    height: int,
+    depth: int,
+    mipmap_count: int,
+    cube_map: bool,
+) -> bytes:
     dds_flags = (
         0x1 | 0x2 | 0x4 | 0x1000
     )  # capabilities  # height  # width  # pixel format
     dds_capabilities1 = 0x1000  # texture
     dds_capabilities2 = 0
 
-    if (ftex_texture_type & 4) != 0:
+    if cube_map:
         # Cube map, with six faces
-        if ftex_depth > 1:
-            raise DecodeError("Unsupported ftex variant")
-        image_count = 6
         dds_depth = 1
         dds_capabilities1 |= 0x8  # complex
         dds_capabilities2 |= 0xFE00  # cube map with six faces
 
         dds_extension_dimension = 3  # 2D
         dds_extension_flags = 0x4  # cube map
-    elif ftex_depth > 1:
+    elif depth > 1:
         # Volume texture
-        image_count = 1
-        dds_depth = ftex_depth
+        dds_depth = depth
         dds_flags |= 0x800000  # depth
         dds_capabilities2 |= 0x200000  # volume texture
 
@@ -183,70 +305,18 @@ def ftex_to_dds_buffer(ftex_buffer: bytes) -> bytes:
         dds_extension_flags = 0
     else:
         # Regular 2D texture
-        image_count = 1
         dds_depth = 1
 
         dds_extension_dimension = 3  # 2D
         dds_extension_flags = 0
 
-    dds_mipmap_count = ftex_mipmap_count
-    mipmap_count = ftex_mipmap_count
+    dds_mipmap_count = mipmap_count
     dds_flags |= 0x20000  # mipmapCount
     dds_capabilities1 |= 0x8  # complex
     dds_capabilities1 |= 0x400000  # mipmap
 
-    # A frame is a byte array containing a single mipmap element of a single image.
-    # Cube maps have six images with mipmaps, and so 6 * $mipmapCount frames.
-    # Other textures just have $mipmapCount frames.
-    frame_specifications = []
-    for i in range(image_count):
-        for j in range(mipmap_count):
-            mipmap_header = bytearray(16)
-            if input_stream.readinto(mipmap_header) != len(mipmap_header):
-                raise DecodeError("Incomplete mipmap header")
-            (
-                offset,
-                size_uncompressed,
-                size_compressed,
-                index,
-                ftexs_number,
-                chunk_count,
-            ) = struct.unpack("< I I I BB H", mipmap_header)
-            if index != j:
-                raise DecodeError("Unexpected mipmap")
-
-            frame_expected_size = dds_mipmap_size(
-                ftex_pixel_fmt, ftex_width, ftex_height, dds_depth, j
-            )
-            frame_specifications.append(
-                (
-                    offset,
-                    chunk_count,
-                    size_uncompressed,
-                    size_compressed,
-                    frame_expected_size,
-                )
-            )
-
-    frames = []
-    for (
-        offset,
-        chunk_count,
-        size_uncompressed,
-        size_compressed,
-        size_expected,
-    ) in frame_specifications:
-        frame = read_image_buffer(
-            input_stream, offset, chunk_count, size_uncompressed, size_compressed
-        )
-        if len(frame) < size_expected:
-            frame += bytes(size_expected - len(frame))
-        elif len(frame) > size_expected:
-            frame = frame[0:size_expected]
-        frames.append(frame)
-
     if ftex_pixel_fmt == 0:
-        dds_pitch_or_linear_size = 4 * ftex_width
+        dds_pitch_or_linear_size = 4 * width
         dds_flags |= 0x8  # pitch
         use_extension_header = False
 
@@ -259,7 +329,9 @@ def ftex_to_dds_buffer(ftex_buffer: bytes) -> bytes:
         dds_b_bit_mask = 0x000000FF
         dds_a_bit_mask = 0xFF000000
     else:
-        dds_pitch_or_linear_size = len(frames[0])
+        dds_pitch_or_linear_size = dds_mipmap_size(
+            ftex_pixel_fmt, width, height, dds_depth, 0
+        )
         dds_flags |= 0x80000  # linear size
 
         dds_format_flags = 0x4  # compressed
@@ -306,75 +378,459 @@ def ftex_to_dds_buffer(ftex_buffer: bytes) -> bytes:
         else:
             use_extension_header = False
 
-    output_stream = io.BytesIO()
-    output_stream.write(
-        struct.pack(
-            "< 4s 7I 44x 2I 4s 5I 2I 12x",
-            b"DDS ",
-            124,  # header size
-            dds_flags,
-            ftex_height,
-            ftex_width,
-            dds_pitch_or_linear_size,
-            dds_depth,
-            dds_mipmap_count,
-            32,  # substructure size
-            dds_format_flags,
-            dds_four_cc,
-            dds_rgb_bit_count,
-            dds_r_bit_mask,
-            dds_g_bit_mask,
-            dds_b_bit_mask,
-            dds_a_bit_mask,
-            dds_capabilities1,
-            dds_capabilities2,
-        )
+    header_buffer = struct.pack(
+        "< 4s 7I 44x 2I 4s 5I 2I 12x",
+        b"DDS ",
+        124,  # header size
+        dds_flags,
+        height,
+        width,
+        dds_pitch_or_linear_size,
+        dds_depth,
+        dds_mipmap_count,
+        32,  # substructure size
+        dds_format_flags,
+        dds_four_cc,
+        dds_rgb_bit_count,
+        dds_r_bit_mask,
+        dds_g_bit_mask,
+        dds_b_bit_mask,
+        dds_a_bit_mask,
+        dds_capabilities1,
+        dds_capabilities2,
     )
 
     if use_extension_header:
-        output_stream.write(
-            struct.pack(
-                "< 5I",
-                dds_extension_format,
-                dds_extension_dimension,
-                dds_extension_flags,
-                1,  # array size
-                0,  # flags
-            )
+        header_buffer += struct.pack(
+            "< 5I",
+            dds_extension_format,
+            dds_extension_dimension,
+            dds_extension_flags,
+            1,  # array size
+            0,  # flags
         )
 
-    for frame in frames:
-        output_stream.write(frame)
+    return header_buffer
 
-    return output_stream.getvalue()
 
+class FtexsFiles:
+    # The .ftexs companions of an ftex, which hold the frames whose mipmap
+    # entry has a non-zero ftexs number. They are named <name>.<number>.ftexs
+    # and each one is only opened and memory-mapped when one of its frames is
+    # first read.
+    def __init__(self, ftex_filepath: str):
+        self._stem = os.path.splitext(ftex_filepath)[0]
+        self._maps = {}
+
+    def __enter__(self):
+        return self
 
-def ftex_to_dds(ftex_filepath: str, dds_filepath: str):
+    def __exit__(self, exc_type, exc_value, traceback):
+        # A frame that failed to decode may still hold views over the maps.
+        drop_error_frames(exc_value)
+        self.close()
+
+    def __getitem__(self, ftexs_number: int) -> mmap.mmap:
+        if (ftexs_map := self._maps.get(ftexs_number)) is None:
+            ftexs_filepath = self.path(ftexs_number)
+            try:
+                ftexs_stream = open(ftexs_filepath, "rb")
+            except FileNotFoundError:
+                raise DecodeError(f"Missing ftexs file {ftexs_filepath}")
+
+            with ftexs_stream:
+                if os.fstat(ftexs_stream.fileno()).st_size == 0:
+                    raise DecodeError(f"Empty ftexs file {ftexs_filepath}")
+                ftexs_map = mmap.mmap(ftexs_stream.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[ftexs_number] = ftexs_map
+        return ftexs_map
+
+    def path(self, ftexs_number: int) -> str:
+        return f"{self._stem}.{ftexs_number}.ftexs"
+
+    def opened(self) -> list[int]:
+        return sorted(self._maps)
+
+    def close(self):
+        for ftexs_map in self._maps.values():
+            ftexs_map.close()
+        self._maps.clear()
+
+
+def frame_source(
+    ftex_view: memoryview, ftexs, ftexs_number: int, ftexs_views: dict
+) -> memoryview:
+    # The view a frame is read from: the ftex itself, or one of its ftexs
+    # files. Views of ftexs files are kept in ftexs_views so that the caller
+    # can release them.
+    if ftexs_number == 0:
+        return ftex_view
+    if (ftexs_view := ftexs_views.get(ftexs_number)) is None:
+        if ftexs is None:
+            raise DecodeError("Missing ftexs file")
+        try:
+            ftexs_view = memoryview(ftexs[ftexs_number])
+        except KeyError:
+            raise DecodeError("Missing ftexs file")
+        ftexs_views[ftexs_number] = ftexs_view
+    return ftexs_view
+
+
+def release_views(ftexs_views: dict):
+    for ftexs_view in ftexs_views.values():
+        ftexs_view.release()
+    ftexs_views.clear()
+
+
+def ftex_to_dds_buffer(ftex_buffer: bytes, workers: int = 1, ftexs=None) -> bytes:
+    # ftexs maps ftexs numbers to the contents of the matching .ftexs files,
+    # such as a dict of buffers or an FtexsFiles. It is only needed when the
+    # texture keeps some of its frames outside of the ftex.
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return _ftex_to_dds_buffer(ftex_buffer, executor, ftexs)
+    return _ftex_to_dds_buffer(ftex_buffer, None, ftexs)
+
+
+def _ftex_to_dds_buffer(
+    ftex_buffer: bytes, executor: Executor = None, ftexs=None
+) -> bytes:
+    start = time.perf_counter()
+    header_buffer, frame_specifications = ftex_to_dds_layout(ftex_buffer)
+
+    # Every frame is decoded in place into a single preallocated buffer. Frames
+    # shorter than expected are padded by the zeroed buffer, longer ones are
+    # truncated.
+    output_buffer = bytearray(
+        len(header_buffer) + sum(spec[4] for spec in frame_specifications)
+    )
+    output_buffer[: len(header_buffer)] = header_buffer
+
+    ftexs_views = {}
+    with (
+        memoryview(ftex_buffer) as input_view,
+        memoryview(output_buffer) as output_view,
+    ):
+        try:
+            frame_offset = len(header_buffer)
+            for (
+                offset,
+                chunk_count,
+                size_uncompressed,
+                size_compressed,
+                size_expected,
+                ftexs_number,
+            ) in frame_specifications:
+                read_image_into(
+                    frame_source(input_view, ftexs, ftexs_number, ftexs_views),
+                    output_view[frame_offset : frame_offset + size_expected],
+                    offset,
+                    chunk_count,
+                    size_uncompressed,
+                    size_compressed,
+                    executor,
+                )
+                frame_offset += size_expected
+        finally:
+            release_views(ftexs_views)
+
+    report_stage(
+        "decode",
+        start,
+        sum(spec[3] for spec in frame_specifications),
+        len(output_buffer),
+    )
+    return output_buffer
+
+
+def ftex_to_dds_stream(
+    ftex_buffer: bytes, output_stream: io.RawIOBase, workers: int = 1, ftexs=None
+):
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return _ftex_to_dds_stream(ftex_buffer, output_stream, executor, ftexs)
+    return _ftex_to_dds_stream(ftex_buffer, output_stream, None, ftexs)
+
+
+def _ftex_to_dds_stream(
+    ftex_buffer: bytes,
+    output_stream: io.RawIOBase,
+    executor: Executor = None,
+    ftexs=None,
+):
+    start = time.perf_counter()
+    header_buffer, frame_specifications = ftex_to_dds_layout(ftex_buffer)
+    output_stream.write(header_buffer)
+
+    # Frames are written out one at a time, so only a single decoded frame
+    # is held in memory.
+    ftexs_views = {}
+    with memoryview(ftex_buffer) as input_view:
+        try:
+            for (
+                offset,
+                chunk_count,
+                size_uncompressed,
+                size_compressed,
+                size_expected,
+                ftexs_number,
+            ) in frame_specifications:
+                frame = bytearray(size_expected)
+                with memoryview(frame) as frame_view:
+                    read_image_into(
+                        frame_source(input_view, ftexs, ftexs_number, ftexs_views),
+                        frame_view,
+                        offset,
+                        chunk_count,
+                        size_uncompressed,
+                        size_compressed,
+                        executor,
+                    )
+                output_stream.write(frame)
+        finally:
+            release_views(ftexs_views)
+
+    report_stage(
+        "decode",
+        start,
+        sum(spec[3] for spec in frame_specifications),
+        len(header_buffer) + sum(spec[4] for spec in frame_specifications),
+    )
+
+
+def ftex_to_dds(ftex_filepath: str, dds_filepath: str, workers: int = 1):
+    with open(ftex_filepath, "rb") as input_stream:
+        if os.fstat(input_stream.fileno()).st_size < 64:
+            raise DecodeError("Incomplete ftex header")
+
+        with (
+            mmap.mmap(input_stream.fileno(), 0, access=mmap.ACCESS_READ) as input_map,
+            FtexsFiles(ftex_filepath) as ftexs,
+            open(dds_filepath, "wb") as output_stream,
+        ):
+            # A partial dds is removed if the ftex turns out to be broken.
+            try:
+                ftex_to_dds_stream(input_map, output_stream, workers, ftexs)
+            except BaseException as e:
+                drop_error_frames(e)
+                output_stream.close()
+                os.remove(dds_filepath)
+                raise
+
+
+def _inflated_size(compressed: memoryview, limit: int) -> int:
+    # Inflates through a fixed-size window and throws the output away, so the
+    # memory used does not depend on the size of the data. Stops as soon as
+    # more than limit bytes come out.
+    decompressor = zlib.decompressobj()
+    size = 0
+    try:
+        data = compressed
+        while data and not decompressor.eof:
+            size += len(decompressor.decompress(data, 1 << 16))
+            if size > limit:
+                return size
+            data = decompressor.unconsumed_tail
+        size += len(decompressor.flush())
+    except zlib.error:
+        raise DecodeError("Decompression error")
+    if not decompressor.eof:
+        raise DecodeError("Decompression error")
+    return size
+
+
+def _verify_frame(
+    source: memoryview,
+    image_offset: int,
+    chunk_count: int,
+    size_uncompressed: int,
+    size_compressed: int,
+):
+    if chunk_count == 0:
+        if size_compressed == 0:
+            if image_offset + size_uncompressed > len(source):
+                raise DecodeError("Unexpected end of stream")
+            return
+        if image_offset + size_compressed > len(source):
+            raise DecodeError("Unexpected end of stream")
+        size = _inflated_size(
+            source[image_offset : image_offset + size_compressed], size_uncompressed
+        )
+        if size != size_uncompressed:
+            raise DecodeError("Unexpected image size")
+        return
+
+    table_end = image_offset + chunk_count * 8
+    total = 0
+    for chunk in read_chunk_table(source, image_offset, chunk_count):
+        start = image_offset + chunk.offset
+        if start < table_end:
+            raise DecodeError("Unexpected chunk offset")
+        if start + chunk.size_compressed > len(source):
+            raise DecodeError("Unexpected end of stream")
+        if chunk.is_compressed:
+            size = _inflated_size(
+                source[start : start + chunk.size_compressed], chunk.size_uncompressed
+            )
+            if size != chunk.size_uncompressed:
+                raise DecodeError("Unexpected chunk size")
+        total += chunk.size_uncompressed
+    if total != size_uncompressed:
+        raise DecodeError("Unexpected image size")
+
+
+def verify_ftex_buffer(ftex_buffer: bytes, ftexs=None):
+    # Checks a whole ftex without decoding it: every table entry must point
+    # inside its file, every chunk must inflate to the size its table gives,
+    # and every frame must add up to the size the mipmap table and its pixel
+    # format call for. Raises DecodeError naming the first bad frame.
+    _, frame_specifications = ftex_to_dds_layout(ftex_buffer)
+
+    ftexs_views = {}
+    with memoryview(ftex_buffer) as input_view:
+        try:
+            for frame_index, (
+                offset,
+                chunk_count,
+                size_uncompressed,
+                size_compressed,
+                size_expected,
+                ftexs_number,
+            ) in enumerate(frame_specifications):
+                try:
+                    _verify_frame(
+                        frame_source(input_view, ftexs, ftexs_number, ftexs_views),
+                        offset,
+                        chunk_count,
+                        size_uncompressed,
+                        size_compressed,
+                    )
+                    if size_uncompressed != size_expected:
+                        raise DecodeError("Unexpected image size")
+                except DecodeError as e:
+                    raise DecodeError(f"{e} in frame {frame_index}")
+        finally:
+            release_views(ftexs_views)
+
+
+def verify_ftex(ftex_filepath: str):
     with open(ftex_filepath, "rb") as input_stream:
-        input_buffer = input_stream.read()
+        if os.fstat(input_stream.fileno()).st_size < 64:
+            raise DecodeError("Incomplete ftex header")
+
+        with (
+            mmap.mmap(input_stream.fileno(), 0, access=mmap.ACCESS_READ) as input_map,
+            FtexsFiles(ftex_filepath) as ftexs,
+        ):
+            try:
+                verify_ftex_buffer(input_map, ftexs)
+            except BaseException as e:
+                drop_error_frames(e)
+                raise
+
 
-    output_buffer = ftex_to_dds_buffer(input_buffer)
+def check_ftex_version(ftex_version: float, ftex_pixel_fmt: int):
+    if ftex_version < 2.025 or ftex_version > 2.045:
+        raise ValueError(f"Unsupported ftex version {ftex_version}")
+    if ftex_version < 2.035 and ftex_pixel_fmt > 4:
+        raise ValueError("Pixel format requires ftex version 2.04")
 
-    with open(dds_filepath, "wb") as outputStream:
-        outputStream.write(output_buffer)
 
+def check_version_patch(header: bytes, ftex_version: float) -> float:
+    # Raises if patch_ftex_version would refuse to retag the ftex starting
+    # with header, and returns its current version otherwise.
+    if len(header) < 64:
+        raise DecodeError("Incomplete ftex header")
 
-def encode_image(data: bytes) -> [bytes, int]:
+    ftex_magic, old_version, ftex_pixel_fmt = struct.unpack_from("< 4s f H", header)
+    if ftex_magic != b"FTEX":
+        raise DecodeError("Incorrect ftex signature")
+    if old_version < 2.025 or old_version > 2.045:
+        raise DecodeError("Unsupported ftex version")
+    check_ftex_version(ftex_version, ftex_pixel_fmt)
+    return old_version
+
+
+def patch_ftex_version(ftex_filepath: str, ftex_version: float) -> float:
+    # Rewrites the version field of an existing ftex in place and returns the
+    # previous version. Only the header is read and only the 4 version bytes
+    # are written, whatever the size of the file.
+    with open(ftex_filepath, "r+b") as ftex_stream:
+        old_version = check_version_patch(ftex_stream.read(64), ftex_version)
+        if round(old_version, 2) != round(ftex_version, 2):
+            ftex_stream.seek(4)
+            ftex_stream.write(struct.pack("< f", ftex_version))
+
+    return old_version
+
+
+# zlib levels used by the encoder, from quick iteration builds to release builds.
+compression_profiles = {
+    "fast": 1,
+    "balanced": 6,
+    "max": 9,
+}
+
+
+def _compress_chunk(chunk: bytes, level: int) -> bytes:
+    compressed_chunk = zlib.compress(chunk, level=level)
+    # Chunks that do not shrink are stored raw, which readers recognise by the
+    # compressed size being equal to the uncompressed one.
+    if len(compressed_chunk) >= len(chunk):
+        return chunk
+    return compressed_chunk
+
+
+def encode_image(
+    data: bytes,
+    executor: Executor = None,
+    profile: str = "max",
+    dedup: bool = False,
+) -> [bytes, int]:
     chunk_size = 1 << 14  # Value known not to crash PES
     chunk_count = (len(data) + chunk_size - 1) // chunk_size
+    level = compression_profiles[profile]
+
+    data_view = memoryview(data)
+    chunks = [
+        data_view[chunk_size * i : chunk_size * (i + 1)] for i in range(chunk_count)
+    ]
+    if dedup:
+        # Every chunk has its own offset in the table, so repeated chunks can
+        # all point at a single copy. Each distinct chunk is compressed once.
+        unique_indices = {}
+        chunk_indices = []
+        unique_chunks = []
+        for chunk in chunks:
+            key = bytes(chunk)
+            if (index := unique_indices.get(key)) is None:
+                index = unique_indices[key] = len(unique_chunks)
+                unique_chunks.append(chunk)
+            chunk_indices.append(index)
+    else:
+        chunk_indices = range(chunk_count)
+        unique_chunks = chunks
+
+    # zlib releases the GIL while compressing, so chunks can be compressed
+    # concurrently on a thread pool. map() keeps the results in chunk order,
+    # which makes the output identical to the serial path.
+    if executor is None:
+        compressed_chunks = map(_compress_chunk, unique_chunks, repeat(level))
+    else:
+        compressed_chunks = executor.map(_compress_chunk, unique_chunks, repeat(level))
 
-    header_buffer = bytearray()
     chunk_buffer = bytearray()
     chunk_buffer_offset = chunk_count * 8
-
-    for i in range(chunk_count):
-        chunk = data[chunk_size * i : chunk_size * (i + 1)]
-        compressed_chunk = zlib.compress(chunk, level=9)
-        offset = len(chunk_buffer)
+    chunk_entries = []
+    for compressed_chunk in compressed_chunks:
+        chunk_entries.append((len(compressed_chunk), len(chunk_buffer)))
         chunk_buffer += compressed_chunk
-        header_buffer += struct.pack(
-            "< HHI",
-            len(compressed_chunk),
+
+    header_buffer = bytearray()
+    for chunk, chunk_index in zip(chunks, chunk_indices):
+        size_compressed, offset = chunk_entries[chunk_index]
+        header_buffer += CHUNK_ENTRY.pack(
+            size_compressed,
             len(chunk),
             offset + chunk_buffer_offset,
         )
@@ -386,9 +842,8 @@ def encode_image(data: bytes) -> [bytes, int]:
     return output, chunk_count
 
 
-def dds_to_ftex_buffer(dds_buffer: bytes, color_space: str = None) -> bytes:
-    input_stream = io.BytesIO(dds_buffer)
-
+def read_dds_header(input_stream: io.BytesIO) -> tuple[int, int, int, int, int, bool]:
+    # Leaves the stream positioned on the first frame.
     header = bytearray(128)
     if input_stream.readinto(header) != len(header):
         raise DecodeError("Incomplete dds header")
@@ -430,10 +885,8 @@ def dds_to_ftex_buffer(dds_buffer: bytes, color_space: str = None) -> bytes:
         if dds_capabilities2 & 0xFE00 != 0xFE00:
             raise DecodeError("Incomplete dds cube maps not supported")
         is_cube_map = True
-        cube_entries = 6
     else:
         is_cube_map = False
-        cube_entries = 1
 
     if dds_capabilities2 & 0x200000 > 0:  # volume texture
         depth = dds_depth
@@ -443,19 +896,6 @@ def dds_to_ftex_buffer(dds_buffer: bytes, color_space: str = None) -> bytes:
     if is_cube_map and depth > 1:
         raise DecodeError("Invalid dds combination: cube map and volume map both set")
 
-    match color_space:
-        case "LINEAR":
-            ftex_texture_type = 0x1
-        case "SRGB":
-            ftex_texture_type = 0x3
-        case "NORMAL":
-            ftex_texture_type = 0x9
-        case _:
-            ftex_texture_type = 0x9
-
-    if is_cube_map:
-        ftex_texture_type |= 0x4
-
     if dds_format_flags & 0x4 == 0:  # fourCC absent
         if all(
             [
@@ -492,7 +932,8 @@ def dds_to_ftex_buffer(dds_buffer: bytes, color_space: str = None) -> bytes:
                     95: 10,  # DXGI_FORMAT_BC6H_UF16
                     98: 11,  # DXGI_FORMAT_BC7_UNORM
                     10: 12,  # DXGI_FORMAT_R16G16B16A16_FLOAT
-                    1: 13,  # DXGI_FORMAT_R32G32B32A32_FLOAT
+                    1: 13,  # DXGI_FORMAT_R32G32B32A32_TYPELESS
+                    2: 13,  # DXGI_FORMAT_R32G32B32A32_FLOAT
                     24: 14,  # DXGI_FORMAT_R10G10B10A2_UNORM
                     26: 15,  # DXGI_FORMAT_R11G11B10_FLOAT
                 }
@@ -512,13 +953,119 @@ def dds_to_ftex_buffer(dds_buffer: bytes, color_space: str = None) -> bytes:
             case _:
                 raise DecodeError("Unsupported dds codec")
 
+    return (
+        ftex_pixel_format,
+        dds_width,
+        dds_height,
+        depth,
+        mipmap_count,
+        is_cube_map,
+    )
+
+
+def color_space_texture_type(color_space: str = None) -> int:
+    match color_space:
+        case "LINEAR":
+            return 0x1
+        case "SRGB":
+            return 0x3
+        case "NORMAL":
+            return 0x9
+        case _:
+            return 0x9
+
+
+def dds_to_ftex_buffer(
+    dds_buffer: bytes,
+    color_space: str = None,
+    workers: int = 1,
+    profile: str = "max",
+    dedup: bool = False,
+) -> bytes:
+    # With dedup, identical chunks within a frame share one stored copy.
+    return dds_stream_to_ftex_buffer(
+        io.BytesIO(dds_buffer), color_space, workers, profile, dedup
+    )
+
+
+def dds_stream_to_ftex_buffer(
+    input_stream: io.BufferedIOBase,
+    color_space: str = None,
+    workers: int = 1,
+    profile: str = "max",
+    dedup: bool = False,
+) -> bytes:
+    # Reads the dds one frame at a time, so only the frame being encoded and
+    # the ftex output are held in memory.
+    output_stream = io.BytesIO()
+    dds_stream_to_ftex_stream(
+        input_stream, output_stream, color_space, workers, profile, dedup
+    )
+    return output_stream.getvalue()
+
+
+def dds_stream_to_ftex_stream(
+    input_stream: io.BufferedIOBase,
+    output_stream: io.RawIOBase,
+    color_space: str = None,
+    workers: int = 1,
+    profile: str = "max",
+    dedup: bool = False,
+):
+    # output_stream must be seekable: the header and mipmap table are written
+    # last, over space reserved for them at the start of the output.
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return _dds_to_ftex_stream(
+                input_stream, output_stream, color_space, executor, profile, dedup
+            )
+    return _dds_to_ftex_stream(
+        input_stream, output_stream, color_space, None, profile, dedup
+    )
+
+
+def _dds_to_ftex_stream(
+    input_stream: io.BufferedIOBase,
+    output_stream: io.RawIOBase,
+    color_space: str = None,
+    executor: Executor = None,
+    profile: str = "max",
+    dedup: bool = False,
+):
+    if profile not in compression_profiles:
+        raise ValueError(f"Unknown compression profile: {profile}")
+
+    start = time.perf_counter()
+    bytes_in = 0
+
+    (
+        ftex_pixel_format,
+        dds_width,
+        dds_height,
+        depth,
+        mipmap_count,
+        is_cube_map,
+    ) = read_dds_header(input_stream)
+    cube_entries = 6 if is_cube_map else 1
+
+    ftex_texture_type = color_space_texture_type(color_space)
+    if is_cube_map:
+        ftex_texture_type |= 0x4
+
     if ftex_pixel_format > 4:
         ftex_version = 2.04
     else:
         ftex_version = 2.03
 
-    frame_buffer = bytearray()
-    mipmap_entries = []
+    # Compressed frames go straight to the output, after the space left for
+    # the header and the mipmap table, so only one frame is held in memory.
+    output_start = output_stream.tell()
+    mipmap_buffer_offset = 64
+    frame_buffer_offset = mipmap_buffer_offset + cube_entries * mipmap_count * 16
+    output_stream.write(bytes(frame_buffer_offset))
+
+    frame_offset = frame_buffer_offset
+    mipmap_buffer = bytearray()
     for _ in range(cube_entries):
         for mipmap_index in range(mipmap_count):
             length = dds_mipmap_size(
@@ -527,39 +1074,22 @@ def dds_to_ftex_buffer(dds_buffer: bytes, color_space: str = None) -> bytes:
             frame = input_stream.read(length)
             if len(frame) != length:
                 raise DecodeError("Unexpected end of dds stream")
+            bytes_in += len(frame)
 
-            frame_offset = len(frame_buffer)
-            (compressed_frame, chunk_count) = encode_image(frame)
-            frame_buffer += compressed_frame
-            mipmap_entries.append(
-                (
-                    frame_offset,
-                    len(frame),
-                    len(compressed_frame),
-                    mipmap_index,
-                    chunk_count,
-                )
+            (compressed_frame, chunk_count) = encode_image(
+                frame, executor, profile, dedup
             )
-
-    mipmap_buffer = bytearray()
-    mipmap_buffer_offset = 64
-    frame_buffer_offset = mipmap_buffer_offset + len(mipmap_entries) * 16
-    for (
-        relative_frame_offset,
-        size_uncompressed,
-        size_compressed,
-        mipmap_index,
-        chunk_count,
-    ) in mipmap_entries:
-        mipmap_buffer += struct.pack(
-            "< III BB H",
-            relative_frame_offset + frame_buffer_offset,
-            size_uncompressed,
-            size_compressed,
-            mipmap_index,
-            0,  # ftexs number
-            chunk_count,
-        )
+            output_stream.write(compressed_frame)
+            mipmap_buffer += MIPMAP_ENTRY.pack(
+                frame_offset,
+                len(frame),
+                len(compressed_frame),
+                mipmap_index,
+                0,  # ftexs number
+                chunk_count,
+            )
+            frame_offset += len(compressed_frame)
+            del frame, compressed_frame
 
     header = struct.pack(
         "< 4s f HHHH  BB HIII  BB 14x  16x",
@@ -581,14 +1111,166 @@ def dds_to_ftex_buffer(dds_buffer: bytes, color_space: str = None) -> bytes:
         # 16 bytes hashes
     )
 
-    return header + mipmap_buffer + frame_buffer
+    output_end = output_stream.tell()
+    output_stream.seek(output_start)
+    output_stream.write(header + mipmap_buffer)
+    output_stream.seek(output_end)
+    report_stage("encode", start, bytes_in, output_end - output_start)
+
+
+def count_shared_chunks(ftex_buffer: bytes) -> tuple[int, int]:
+    # Returns the number of chunks in the ftex and how many of them point at
+    # data already used by an earlier chunk of the same frame.
+    _, frame_specifications = ftex_to_dds_layout(ftex_buffer)
+    chunk_total = 0
+    shared_chunks = 0
+    for offset, chunk_count, *_, ftexs_number in frame_specifications:
+        if ftexs_number != 0:
+            # Only frames stored in the ftex itself are looked at.
+            continue
+        chunk_offsets = {
+            chunk.offset for chunk in read_chunk_table(ftex_buffer, offset, chunk_count)
+        }
+        chunk_total += chunk_count
+        shared_chunks += chunk_count - len(chunk_offsets)
+    return chunk_total, shared_chunks
+
+
+def dds_to_ftex(
+    dds_filepath: str,
+    ftex_filepath: str,
+    color_space: str = None,
+    workers: int = 1,
+    profile: str = "max",
+    dedup: bool = False,
+):
+    # WESYS compressed dds files are inflated as they are read, and frames are
+    # encoded straight into the ftex file, so memory use stays around a single
+    # frame whatever the size of the texture. A partial ftex is removed if the
+    # dds turns out to be broken.
+    with open(dds_filepath, "rb") as input_stream:
+        with open(ftex_filepath, "wb") as output_stream:
+            try:
+                dds_stream_to_ftex_stream(
+                    open_decompress(input_stream),
+                    output_stream,
+                    color_space,
+                    workers,
+                    profile,
+                    dedup,
+                )
+            except BaseException:
+                output_stream.close()
+                os.remove(ftex_filepath)
+                raise
+
 
+def transcode_ftex_buffer(
+    ftex_buffer: bytes, ftex_version: float = None, color_space: str = None, ftexs=None
+) -> bytes:
+    # Rewrites an ftex without touching its pixel data. The chunk tables and
+    # compressed chunks of every frame are copied over as they are, since
+    # chunk offsets are relative to their frame, and only the header and the
+    # mipmap table are rebuilt. Frames kept in .ftexs files are pulled into
+    # the output, which is always a single-file ftex.
+    _, frame_specifications = ftex_to_dds_layout(ftex_buffer)
+
+    ftex_header = FtexHeader(ftex_buffer)
+    header = bytearray(ftex_buffer[:64])
+    ftex_mipmap_count = ftex_header.mipmap_count
+    ftex_texture_type = ftex_header.texture_type
+    if ftex_version is not None:
+        check_ftex_version(ftex_version, ftex_header.pixel_fmt)
+        struct.pack_into("< f", header, 4, ftex_version)
+    if color_space is not None:
+        ftex_texture_type = (ftex_texture_type & ~0xB) | color_space_texture_type(
+            color_space
+        )
+        struct.pack_into("< I", header, 28, ftex_texture_type)
+    header[32] = 0  # ftexs count
 
-def dds_to_ftex(dds_filepath: str, ftex_filepath: str, color_space: str = None):
-    with open(dds_filepath, "rb") as input_stream:
-        input_buffer = input_stream.read()
+    frame_buffer_offset = 64 + len(frame_specifications) * 16
+    mipmap_buffer = bytearray()
+    frame_buffer = bytearray()
+    ftexs_views = {}
+    with memoryview(ftex_buffer) as input_view:
+        try:
+            for frame_index, (
+                offset,
+                chunk_count,
+                size_uncompressed,
+                size_compressed,
+                _,
+                ftexs_number,
+            ) in enumerate(frame_specifications):
+                source = frame_source(input_view, ftexs, ftexs_number, ftexs_views)
+
+                if chunk_count == 0:
+                    size = size_compressed or size_uncompressed
+                else:
+                    # The stored size should already cover every chunk, but
+                    # the table is what readers go by.
+                    size = max(
+                        size_compressed,
+                        *(
+                            chunk.offset + chunk.size_compressed
+                            for chunk in read_chunk_table(source, offset, chunk_count)
+                        ),
+                    )
+                if offset + size > len(source):
+                    raise DecodeError("Unexpected end of stream")
+
+                mipmap_buffer += MIPMAP_ENTRY.pack(
+                    frame_buffer_offset + len(frame_buffer),
+                    size_uncompressed,
+                    size_compressed,
+                    frame_index % ftex_mipmap_count,
+                    0,  # ftexs number
+                    chunk_count,
+                )
+                frame_buffer += source[offset : offset + size]
+                if len(frame_buffer) % 8 > 0:
+                    frame_buffer += bytearray(8 - len(frame_buffer) % 8)
+        finally:
+            release_views(ftexs_views)
+
+    return bytes(header + mipmap_buffer + frame_buffer)
 
-    output_buffer = dds_to_ftex_buffer(try_decompress(input_buffer), color_space)
 
-    with open(ftex_filepath, "wb") as output_stream:
+def transcode_ftex(
+    ftex_filepath: str,
+    output_filepath: str,
+    ftex_version: float = None,
+    color_space: str = None,
+):
+    with open(ftex_filepath, "rb") as input_stream:
+        if os.fstat(input_stream.fileno()).st_size < 64:
+            raise DecodeError("Incomplete ftex header")
+
+        with (
+            mmap.mmap(input_stream.fileno(), 0, access=mmap.ACCESS_READ) as input_map,
+            FtexsFiles(ftex_filepath) as ftexs,
+        ):
+            try:
+                output_buffer = transcode_ftex_buffer(
+                    input_map, ftex_version, color_space, ftexs
+                )
+            except BaseException as e:
+                drop_error_frames(e)
+                raise
+
+    with open(output_filepath, "wb") as output_stream:
         output_stream.write(output_buffer)
+
+
+def measure_compression_profiles(
+    dds_buffer: bytes, color_space: str = None, workers: int = 1
+) -> dict[str, tuple[float, int]]:
+    # Encodes the texture with every profile and reports, for each one, the
+    # time spent in seconds and the size of the resulting ftex.
+    results = {}
+    for profile in compression_profiles:
+        start = time.perf_counter()
+        output_buffer = dds_to_ftex_buffer(dds_buffer, color_space, workers, profile)
+        results[profile] = (time.perf_counter() - start, len(output_buffer))
+    return results
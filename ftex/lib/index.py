@@ -0,0 +1,291 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Iterable
+
+from .fpk import FpkArchive
+from .ftex import report_stage
+from .parser import DecodeError, FtexHeader, read_mipmap_table
+from .profiling import StageProfiler
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS textures (
+    path TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    magic BLOB,
+    version REAL,
+    pixel_fmt INTEGER,
+    width INTEGER,
+    height INTEGER,
+    depth INTEGER,
+    mipmap_count INTEGER,
+    nrt INTEGER,
+    flags INTEGER,
+    unknown_1 INTEGER,
+    unknown_2 INTEGER,
+    texture_type INTEGER,
+    ftexs_count INTEGER,
+    unknown_3 INTEGER,
+    hash_1 BLOB,
+    hash_2 BLOB,
+    size_uncompressed INTEGER,
+    size_compressed INTEGER
+);
+CREATE TABLE IF NOT EXISTS mipmaps (
+    path TEXT NOT NULL,
+    face INTEGER NOT NULL,
+    mipmap INTEGER NOT NULL,
+    ftexs_number INTEGER,
+    chunk_count INTEGER,
+    size_uncompressed INTEGER,
+    size_compressed INTEGER,
+    PRIMARY KEY (path, face, mipmap)
+);
+CREATE INDEX IF NOT EXISTS textures_source ON textures (source);
+CREATE INDEX IF NOT EXISTS textures_pixel_fmt ON textures (pixel_fmt, width, height);
+"""
+
+
+def read_ftex_metadata(ftex_buffer: bytes) -> tuple[tuple, list[tuple]]:
+    # The header fields, in the order of the textures columns, and a
+    # (face, mipmap, ftexs_number, chunk_count, size_uncompressed,
+    # size_compressed) row for each entry of the mipmap table.
+    header = FtexHeader(ftex_buffer)
+    if header.magic != b"FTEX":
+        raise DecodeError("Incorrect ftex signature")
+
+    mipmaps = [
+        (
+            frame_index // header.mipmap_count,
+            frame_index % header.mipmap_count,
+            mipmap.ftexs_number,
+            mipmap.chunk_count,
+            mipmap.size_uncompressed,
+            mipmap.size_compressed,
+        )
+        for frame_index, mipmap in enumerate(read_mipmap_table(ftex_buffer, header))
+    ]
+    return header.astuple(), mipmaps
+
+
+def _read_table(path: str) -> bytes:
+    # The header and the mipmap table, which is all the index needs.
+    start = time.perf_counter()
+    with open(path, "rb") as fd:
+        buffer = fd.read(64)
+        if len(buffer) == 64:
+            header = FtexHeader(buffer)
+            buffer += fd.read(16 * header.mipmap_count * header.face_count)
+    report_stage("read", start, len(buffer), len(buffer))
+    return buffer
+
+
+def _parse_source(
+    source: str,
+) -> tuple[list[tuple[str, tuple, list[tuple]]], list[tuple[str, Exception]]]:
+    # The entries of a .fpk are indexed as <archive>:<entry name>, like
+    # ftex_info reports them. Entries that do not parse are left out, and
+    # returned with their error instead.
+    entries = []
+    failures = []
+    if source.split(".")[-1].lower() == "fpk":
+        with FpkArchive(source) as archive:
+            for entry in archive.ftex_entries():
+                with archive.view(entry) as view:
+                    try:
+                        header, mipmaps = read_ftex_metadata(view)
+                    except DecodeError as e:
+                        failures.append((f"{source}:{entry.name}", e))
+                        continue
+                entries.append((f"{source}:{entry.name}", header, mipmaps))
+    else:
+        header, mipmaps = read_ftex_metadata(_read_table(source))
+        entries.append((source, header, mipmaps))
+    return entries, failures
+
+
+class TextureIndex:
+    # Persistent ftex metadata in an SQLite database. Files are recorded with
+    # their size and modification time, and a refresh only parses the files
+    # whose size or modification time changed since they were indexed.
+    def __init__(self, database: str):
+        self.connection = sqlite3.connect(database)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def _scope(root: str) -> tuple[str, tuple]:
+        # Matches root itself and everything below it, as a range over the
+        # primary key rather than a LIKE pattern.
+        root = os.path.abspath(root)
+        prefix = os.path.join(root, "")
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return "(source = ? OR (source >= ? AND source < ?))", (root, prefix, upper)
+
+    def _forget(self, source: str):
+        self.connection.execute(
+            "DELETE FROM mipmaps WHERE path IN "
+            "(SELECT path FROM textures WHERE source = ?)",
+            (source,),
+        )
+        self.connection.execute("DELETE FROM textures WHERE source = ?", (source,))
+        self.connection.execute("DELETE FROM sources WHERE source = ?", (source,))
+
+    def refresh(
+        self,
+        root: str,
+        paths: Iterable[str],
+        workers: int = 16,
+        profiler: StageProfiler = None,
+    ) -> tuple[int, int, int, list[tuple[str, Exception]]]:
+        # Brings the index up to date with paths, the ftex and fpk files found
+        # under root. Files under root that are no longer listed are dropped.
+        # Returns the number of files parsed, kept as they were and dropped,
+        # and the files and archive entries that could not be read, with
+        # their error. Files that could not be read at all are not recorded,
+        # so that the next refresh tries them again. The stages of each parse
+        # are attributed to its file when a profiler is given.
+        scope, scope_params = self._scope(root)
+        known = {
+            row["source"]: (row["size"], row["mtime_ns"])
+            for row in self.connection.execute(
+                f"SELECT source, size, mtime_ns FROM sources WHERE {scope}",
+                scope_params,
+            )
+        }
+
+        changed = []
+        unchanged = 0
+        for path in paths:
+            source = os.path.abspath(path)
+            try:
+                stat = os.stat(source)
+            except OSError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if known.pop(source, None) == signature:
+                unchanged += 1
+            else:
+                changed.append((source, signature))
+
+        def parse(source: str) -> tuple[list | None, list[tuple[str, Exception]]]:
+            try:
+                with profiler.file(source) if profiler is not None else nullcontext():
+                    return _parse_source(source)
+            except (OSError, DecodeError) as e:
+                return None, [(source, e)]
+
+        failures = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            parsed = executor.map(parse, [source for source, _ in changed])
+            with self.connection:
+                for source in known:
+                    self._forget(source)
+                for (source, (size, mtime_ns)), (entries, errors) in zip(
+                    changed, parsed
+                ):
+                    self._forget(source)
+                    failures.extend(errors)
+                    if entries is None:
+                        continue
+                    self.connection.execute(
+                        "INSERT INTO sources VALUES (?, ?, ?)",
+                        (source, size, mtime_ns),
+                    )
+                    for path, header, mipmaps in entries:
+                        self.connection.execute(
+                            "INSERT OR REPLACE INTO textures VALUES "
+                            f"(?, ?, {', '.join('?' * len(header))}, ?, ?)",
+                            (
+                                path,
+                                source,
+                                *header,
+                                sum(mipmap[4] for mipmap in mipmaps),
+                                sum(mipmap[5] for mipmap in mipmaps),
+                            ),
+                        )
+                        self.connection.execute(
+                            "DELETE FROM mipmaps WHERE path = ?", (path,)
+                        )
+                        self.connection.executemany(
+                            "INSERT INTO mipmaps VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            [(path, *mipmap) for mipmap in mipmaps],
+                        )
+        return len(changed), unchanged, len(known), failures
+
+    def query(
+        self,
+        root: str = None,
+        pixel_fmts: list[int] = None,
+        version: float = None,
+        min_size: int = None,
+        max_size: int = None,
+        cube: bool = None,
+        volume: bool = None,
+        min_ratio: float = None,
+        max_ratio: float = None,
+    ) -> list[sqlite3.Row]:
+        # Textures matching every given filter, in path order. The pixel
+        # format and version filters are the exception: like the checks of
+        # ftex_info's scan mode, a texture passes them by matching either one.
+        # None leaves a filter out, while an empty pixel_fmts matches nothing.
+        # Sizes compare against the larger of the width and the height, and
+        # the ratio is the compressed size of all mipmaps over their
+        # uncompressed size.
+        conditions = []
+        params = []
+        if root is not None:
+            scope, scope_params = self._scope(root)
+            conditions.append(scope)
+            params.extend(scope_params)
+        checks = []
+        if pixel_fmts is not None:
+            checks.append(f"pixel_fmt IN ({', '.join('?' * len(pixel_fmts))})")
+            params.extend(pixel_fmts)
+        if version is not None:
+            checks.append("round(version, 2) = ?")
+            params.append(version)
+        if checks:
+            conditions.append(f"({' OR '.join(checks)})")
+        if min_size is not None:
+            conditions.append("max(width, height) >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            conditions.append("max(width, height) <= ?")
+            params.append(max_size)
+        if cube is not None:
+            conditions.append(f"(texture_type & 4) {'!=' if cube else '='} 0")
+        if volume is not None:
+            conditions.append(f"depth {'>' if volume else '<='} 1")
+        if min_ratio is not None:
+            conditions.append("size_compressed >= ? * size_uncompressed")
+            params.append(min_ratio)
+        if max_ratio is not None:
+            conditions.append("size_compressed <= ? * size_uncompressed")
+            params.append(max_ratio)
+
+        statement = "SELECT * FROM textures"
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+        return self.connection.execute(statement + " ORDER BY path", params).fetchall()
+
+    def mipmaps(self, path: str) -> list[sqlite3.Row]:
+        return self.connection.execute(
+            "SELECT * FROM mipmaps WHERE path = ? ORDER BY face, mipmap", (path,)
+        ).fetchall()
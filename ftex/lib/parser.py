@@ -0,0 +1,121 @@
+import struct
+from typing import NamedTuple
+
+
+class DecodeError(Exception):
+    pass
+
+
+# Compiled once and shared by every reader of the ftex layout.
+FTEX_HEADER = struct.Struct("< 4s f HHHH  BB HIII  BB 14x  8s 8s")
+MIPMAP_ENTRY = struct.Struct("< I I I BB H")
+CHUNK_ENTRY = struct.Struct("< HH I")
+
+
+class FtexHeader:
+    # The 64-byte ftex header, unpacked straight from the buffer, which may be
+    # a memoryview over a mapped file. Nothing is copied.
+    __slots__ = (
+        "magic",
+        "version",
+        "pixel_fmt",
+        "width",
+        "height",
+        "depth",
+        "mipmap_count",
+        "nrt",
+        "flags",
+        "unknown_1",
+        "unknown_2",
+        "texture_type",
+        "ftexs_count",
+        "unknown_3",
+        "hash_1",
+        "hash_2",
+    )
+
+    def __init__(self, data_buffer: bytes):
+        if len(data_buffer) < FTEX_HEADER.size:
+            raise DecodeError("Incomplete ftex header")
+
+        (
+            self.magic,
+            self.version,
+            self.pixel_fmt,
+            self.width,
+            self.height,
+            self.depth,
+            self.mipmap_count,
+            self.nrt,
+            self.flags,
+            self.unknown_1,
+            self.unknown_2,
+            self.texture_type,
+            self.ftexs_count,
+            self.unknown_3,
+            self.hash_1,
+            self.hash_2,
+        ) = FTEX_HEADER.unpack_from(data_buffer)
+
+    @property
+    def is_cube_map(self) -> bool:
+        return (self.texture_type & 4) != 0
+
+    @property
+    def face_count(self) -> int:
+        return 6 if self.is_cube_map else 1
+
+    def astuple(self) -> tuple:
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+
+class MipmapEntry(NamedTuple):
+    offset: int
+    size_uncompressed: int
+    size_compressed: int
+    index: int
+    ftexs_number: int
+    chunk_count: int
+
+
+class ChunkEntry(NamedTuple):
+    # offset is relative to the start of the frame, with its top bit, whose
+    # meaning is unknown, already cleared.
+    size_compressed: int
+    size_uncompressed: int
+    offset: int
+
+    @property
+    def is_compressed(self) -> bool:
+        return self.size_compressed != self.size_uncompressed
+
+
+def read_mipmap_table(ftex_buffer: bytes, header: FtexHeader) -> list[MipmapEntry]:
+    # Cube maps have a table entry per mipmap of each of their six faces.
+    table_end = FTEX_HEADER.size + header.face_count * header.mipmap_count * 16
+    if table_end > len(ftex_buffer):
+        raise DecodeError("Incomplete mipmap header")
+    # Records are built straight from the unpacked tuples, which keeps the
+    # cost per entry close to that of unpacking alone.
+    return list(
+        map(
+            MipmapEntry._make,
+            MIPMAP_ENTRY.iter_unpack(
+                memoryview(ftex_buffer)[FTEX_HEADER.size : table_end]
+            ),
+        )
+    )
+
+
+def read_chunk_table(
+    source: bytes, image_offset: int, chunk_count: int
+) -> list[ChunkEntry]:
+    table_end = image_offset + chunk_count * CHUNK_ENTRY.size
+    if table_end > len(source):
+        raise DecodeError("Incomplete chunk header")
+    return [
+        ChunkEntry._make((size_compressed, size_uncompressed, offset & ~(1 << 31)))
+        for size_compressed, size_uncompressed, offset in CHUNK_ENTRY.iter_unpack(
+            memoryview(source)[image_offset:table_end]
+        )
+    ]
@@ -0,0 +1,134 @@
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Iterable, Iterator
+
+# Marks the end of the items flowing through a stage queue.
+_DONE = object()
+
+
+class _Failed:
+    # Stands in for the value of an item that failed in an earlier stage, so
+    # that the error travels to the output in order with the other results.
+    def __init__(self, error: str):
+        self.error = error
+
+
+def _run_stage(
+    function: Callable,
+    input_queue: queue.Queue,
+    output_queue: queue.Queue,
+):
+    while (entry := input_queue.get()) is not _DONE:
+        item, value = entry
+        if not isinstance(value, _Failed):
+            try:
+                value = function(value)
+            except Exception as e:
+                value = _Failed(f"{type(e).__name__}: {e}")
+        output_queue.put((item, value))
+    input_queue.put(_DONE)  # Lets the other threads of the stage stop too.
+
+
+def _skip_none(function: Callable) -> Callable:
+    def stage(value):
+        if value is None:
+            return None
+        return function(value)
+
+    return stage
+
+
+def run_pipeline(
+    items: Iterable,
+    stages: list[tuple[Callable, int]],
+    queue_size: int = 8,
+) -> Iterator[tuple[object, object, str | None]]:
+    # Runs every item through the stages in order. Each stage is a function
+    # and the number of threads running it, and consecutive stages are linked
+    # by queues of at most queue_size entries. A full queue blocks the stage
+    # feeding it, which bounds the number of items in flight whatever the
+    # speed of each stage. Yields (item, result, error) as items come out of
+    # the last stage, which is not necessarily the input order. A function
+    # returning None drops the item from the later stages, and its result is
+    # None.
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    threads = []
+    for (function, thread_count), input_queue, output_queue in zip(
+        stages, queues, queues[1:]
+    ):
+        stage_threads = [
+            threading.Thread(
+                target=_run_stage,
+                args=(_skip_none(function), input_queue, output_queue),
+                daemon=True,
+            )
+            for _ in range(max(thread_count, 1))
+        ]
+        threads.append(stage_threads)
+        for thread in stage_threads:
+            thread.start()
+
+    def feed():
+        for item in items:
+            queues[0].put((item, item))
+        queues[0].put(_DONE)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    def close_stage(index: int):
+        # Once every thread of a stage is done, nothing more reaches the
+        # next queue, and the next stage can be told to stop.
+        for thread in threads[index]:
+            thread.join()
+        queues[index + 1].put(_DONE)
+
+    closers = [
+        threading.Thread(target=close_stage, args=(index,), daemon=True)
+        for index in range(len(stages))
+    ]
+    for closer in closers:
+        closer.start()
+
+    while (entry := queues[-1].get()) is not _DONE:
+        item, value = entry
+        if isinstance(value, _Failed):
+            yield item, None, value.error
+        else:
+            yield item, value, None
+
+
+def run_largest_first(
+    function: Callable,
+    tasks: list[tuple],
+    jobs: int,
+    keep_order: bool = False,
+) -> Iterator:
+    # Calls function(*task) for every task in a pool of jobs processes and
+    # yields what it returns, in the order of tasks or as the calls complete.
+    # The first item of a task is the path of its input file. The largest
+    # files go first, so that a big texture does not end up running alone at
+    # the end of the batch.
+    sizes = []
+    for task in tasks:
+        try:
+            sizes.append(os.path.getsize(task[0]))
+        except OSError:
+            sizes.append(0)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # futures[position] runs tasks[order[position]].
+        order = sorted(range(len(tasks)), key=sizes.__getitem__, reverse=True)
+        futures = [executor.submit(function, *tasks[index]) for index in order]
+        if keep_order:
+            done = [
+                futures[position]
+                for position in sorted(range(len(order)), key=order.__getitem__)
+            ]
+        else:
+            done = as_completed(futures)
+
+        for future in done:
+            yield future.result()
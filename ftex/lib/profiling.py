@@ -0,0 +1,84 @@
+import threading
+from contextlib import contextmanager
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    # Nearest-rank percentile of an already sorted list.
+    index = max(round(percent / 100 * len(values)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+class StageProfiler:
+    # Collects the stage reports of lib.ftex's profile hook, plus any stage
+    # timed by the scripts themselves, and attributes each one to the file
+    # that the current thread is working on.
+    def __init__(self):
+        self.records = []
+        self._local = threading.local()
+
+    def __getstate__(self) -> dict:
+        # Copies sent to other processes start empty, so that their records
+        # can be merged back as they are.
+        return {"records": []}
+
+    def __setstate__(self, state: dict):
+        self.records = state["records"]
+        self._local = threading.local()
+
+    @contextmanager
+    def file(self, path: str):
+        previous = getattr(self._local, "path", None)
+        self._local.path = path
+        try:
+            yield
+        finally:
+            self._local.path = previous
+
+    def record(self, stage: str, seconds: float, bytes_in: int, bytes_out: int):
+        self.records.append(
+            (getattr(self._local, "path", None), stage, seconds, bytes_in, bytes_out)
+        )
+
+    def merge(self, records: list[tuple]):
+        self.records.extend(records)
+
+    def summary(self, slowest: int = 5) -> dict:
+        stages = {}
+        for record in self.records:
+            stages.setdefault(record[1], []).append(record)
+
+        summary = {
+            "files": len({record[0] for record in self.records} - {None}),
+            "stages": {},
+        }
+        for stage, records in stages.items():
+            seconds = sorted(record[2] for record in records)
+            bytes_in = sum(record[3] for record in records)
+            bytes_out = sum(record[4] for record in records)
+            summary["stages"][stage] = {
+                "count": len(records),
+                "seconds": {
+                    "total": sum(seconds),
+                    "mean": sum(seconds) / len(seconds),
+                    "p50": _percentile(seconds, 50),
+                    "p90": _percentile(seconds, 90),
+                    "p99": _percentile(seconds, 99),
+                    "max": seconds[-1],
+                },
+                "bytes_in": bytes_in,
+                "bytes_out": bytes_out,
+                "ratio": bytes_out / bytes_in if bytes_in else None,
+                "slowest": [
+                    [record[0], record[2]]
+                    for record in sorted(records, key=lambda record: -record[2])[
+                        :slowest
+                    ]
+                ],
+            }
+
+        if summary["stages"]:
+            summary["slowest_stage"] = max(
+                summary["stages"],
+                key=lambda stage: summary["stages"][stage]["seconds"]["total"],
+            )
+        return summary
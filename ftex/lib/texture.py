@@ -0,0 +1,174 @@
+import mmap
+import os
+from collections import OrderedDict
+from concurrent.futures import Executor
+
+from .ftex import (
+    DecodeError,
+    FtexsFiles,
+    drop_error_frames,
+    encode_dds_header,
+    frame_source,
+    ftex_to_dds_layout,
+    read_image_into,
+    release_views,
+)
+from .parser import FtexHeader
+
+
+class FtexTexture:
+    # Random access to the frames of an ftex. The header and mipmap table are
+    # parsed once, and a frame is only decompressed when it is asked for. The
+    # most recently decoded frames are kept in a small LRU cache. Frames kept
+    # in .ftexs files are read from ftexs, which defaults to the companions of
+    # the ftex when it is opened from a path.
+    def __init__(
+        self,
+        source: bytes | str | os.PathLike | mmap.mmap,
+        cache_size: int = 8,
+        executor: Executor = None,
+        ftexs=None,
+    ):
+        self._file = None
+        self._map = None
+        self._own_ftexs = None
+        self._ftexs_views = {}
+        if isinstance(source, (str, os.PathLike)):
+            self._file = open(source, "rb")
+            if os.fstat(self._file.fileno()).st_size < 64:
+                self._file.close()
+                raise DecodeError("Incomplete ftex header")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if ftexs is None:
+                ftexs = self._own_ftexs = FtexsFiles(os.fspath(source))
+            source = self._map
+
+        self._view = memoryview(source)
+        self.cache_size = cache_size
+        self.executor = executor
+        self.ftexs = ftexs
+        self._cache = OrderedDict()
+
+        try:
+            self.dds_header, self._frames = ftex_to_dds_layout(self._view)
+        except BaseException:
+            self.close()
+            raise
+
+        header = FtexHeader(self._view)
+        self.version = header.version
+        self.pixel_fmt = header.pixel_fmt
+        self.width = header.width
+        self.height = header.height
+        self.depth = header.depth
+        self.mipmap_count = header.mipmap_count
+        self.texture_type = header.texture_type
+        self.ftexs_count = header.ftexs_count
+        self.is_cube_map = header.is_cube_map
+        self.face_count = header.face_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        drop_error_frames(exc_value)
+        self.close()
+
+    def close(self):
+        self._cache.clear()
+        release_views(self._ftexs_views)
+        if self._own_ftexs is not None:
+            self._own_ftexs.close()
+            self._own_ftexs = None
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def mipmap_dimensions(self, mipmap_index: int) -> tuple[int, int, int]:
+        return (
+            max(self.width >> mipmap_index, 1),
+            max(self.height >> mipmap_index, 1),
+            max(self.depth >> mipmap_index, 1),
+        )
+
+    def _frame_index(self, face: int, mipmap_index: int) -> int:
+        if not 0 <= face < self.face_count:
+            raise IndexError("Face out of range")
+        if not 0 <= mipmap_index < self.mipmap_count:
+            raise IndexError("Mipmap out of range")
+        return face * self.mipmap_count + mipmap_index
+
+    def frame(self, face: int = 0, mipmap_index: int = 0) -> bytes:
+        # The decoded frame, padded or truncated to its size in a DDS file.
+        index = self._frame_index(face, mipmap_index)
+        if (frame := self._cache.get(index)) is not None:
+            self._cache.move_to_end(index)
+            return frame
+
+        (
+            offset,
+            chunk_count,
+            size_uncompressed,
+            size_compressed,
+            size_expected,
+            ftexs_number,
+        ) = self._frames[index]
+        frame = bytearray(size_expected)
+        with memoryview(frame) as frame_view:
+            read_image_into(
+                frame_source(self._view, self.ftexs, ftexs_number, self._ftexs_views),
+                frame_view,
+                offset,
+                chunk_count,
+                size_uncompressed,
+                size_compressed,
+                self.executor,
+            )
+        frame = bytes(frame)
+
+        if self.cache_size > 0:
+            self._cache[index] = frame
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return frame
+
+    def rgba(self, face: int = 0, mipmap_index: int = 0):
+        # Imported here so that numpy, an optional dependency, is only needed
+        # for pixel access.
+        from .bcn import decode_frame
+
+        return decode_frame(
+            self.frame(face, mipmap_index),
+            self.pixel_fmt,
+            *self.mipmap_dimensions(mipmap_index),
+        )
+
+    def to_dds(self, first_mipmap: int = 0, mipmap_count: int = None) -> bytes:
+        # A DDS holding only the requested mipmaps. Starting past the first
+        # mipmap gives a smaller texture, and none of the skipped mipmaps are
+        # decompressed.
+        if mipmap_count is None:
+            mipmap_count = self.mipmap_count - first_mipmap
+        if first_mipmap < 0 or mipmap_count < 1:
+            raise IndexError("Mipmap out of range")
+        if first_mipmap + mipmap_count > self.mipmap_count:
+            raise IndexError("Mipmap out of range")
+
+        buffers = [
+            encode_dds_header(
+                self.pixel_fmt,
+                *self.mipmap_dimensions(first_mipmap),
+                mipmap_count,
+                self.is_cube_map,
+            )
+        ]
+        for face in range(self.face_count):
+            for mipmap_index in range(first_mipmap, first_mipmap + mipmap_count):
+                buffers.append(self.frame(face, mipmap_index))
+        return b"".join(buffers)